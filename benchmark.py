@@ -0,0 +1,880 @@
+import sys
+import os
+import gc
+import time
+import random
+import tracemalloc
+import generate_markov
+
+
+"""
+bench_composition_growth
+Input: the number of calls to create_composition, and how many calls make up one report window
+Description: Calls create_composition over and over and measures the latency and traced memory of every window
+Output: A list of (calls so far, mean seconds per call, traced memory in bytes) tuples
+"""
+def bench_composition_growth(calls=10000, window=1000):
+    random.seed(0)
+    results = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(1, calls + 1):
+        generate_markov.create_composition(generate_markov.MEASURES, 0.5)
+        if i % window == 0 or i == calls:
+            elapsed = time.perf_counter() - start
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            results.append((i, elapsed / (i - (results[-1][0] if results else 0)), current))
+            print(f"{i:>6} calls: {results[-1][1] * 1000:8.2f} ms/call, {current / 1024:10.1f} KiB traced")
+            start = time.perf_counter()
+    tracemalloc.stop()
+    return results
+
+
+"""
+bench_melody_assembly
+Input: the smallest and largest number of measures to try
+Description: Times how long it takes to pair a rhythm with a pitch sequence, doubling the measure count each step
+Output: A list of (measures, notes, seconds) tuples
+"""
+def bench_melody_assembly(smallest=8, largest=4096):
+    random.seed(0)
+    results = []
+    measures = smallest
+    while measures <= largest:
+        durations = generate_markov.rhythm_durations(measures, 0.5)
+        pitches = generate_markov.generate_sequence(generate_markov.melody_chain, len(durations))
+        start = time.perf_counter()
+        generate_markov.build_melody_part(pitches, durations)
+        elapsed = time.perf_counter() - start
+        results.append((measures, len(durations), elapsed))
+        print(f"{measures:>5} measures, {len(durations):>6} notes: {elapsed * 1000:9.2f} ms ({elapsed / measures * 1e6:7.1f} us/measure)")
+        measures *= 2
+    return results
+
+
+"""
+bench_batch_sequences
+Input: the number of sequences, and the length of each sequence
+Description: Compares generating the sequences one at a time with generate_sequence against one
+generate_sequences call, for both the melody and the chord chain
+Output: A list of (chain name, seconds one at a time, seconds batched) tuples
+"""
+def bench_batch_sequences(batch=5000, count=32):
+    random.seed(0)
+    results = []
+    for name, chain in [('melody', generate_markov.melody_chain), ('chord', generate_markov.chord_chain)]:
+        start = time.perf_counter()
+        for _ in range(batch):
+            generate_markov.generate_sequence(chain, count)
+        serial = time.perf_counter() - start
+        start = time.perf_counter()
+        generate_markov.generate_sequences(chain, count, batch, seed=0)
+        batched = time.perf_counter() - start
+        results.append((name, serial, batched))
+        print(f"{name:>6}: {batch} x {count} tokens, one at a time {serial * 1000:8.1f} ms, batched {batched * 1000:7.1f} ms ({serial / batched:5.1f}x)")
+    return results
+
+
+"""
+bench_generation_workers
+Input: the number of generations, and the largest number of worker processes to try
+Description: Times project.compose_generations with 1, 2, 4, ... workers on the same seeds
+Output: A list of (workers, generations per second) tuples
+"""
+def bench_generation_workers(generations=32, max_workers=None):
+    import project
+    max_workers = max_workers or os.cpu_count()
+    seeds = list(range(generations))
+    results = []
+    workers = 1
+    while workers <= max_workers:
+        start = time.perf_counter()
+        project.compose_generations(seeds, workers=workers)
+        elapsed = time.perf_counter() - start
+        results.append((workers, generations / elapsed))
+        print(f"{workers:>3} workers: {generations / elapsed:7.2f} generations/s")
+        workers *= 2
+    return results
+
+
+"""
+bench_fitness
+Input: the number of measures to score, for each mood
+Description: Scores the same measures with reference_operators.fitness_function + generalFitnessFunction and with the
+fitness engine, checks both give the same score, and reports the time per measure
+Output: A list of (mood, microseconds per measure before, microseconds per measure after) tuples
+"""
+def bench_fitness(measures=256):
+    import reference_operators
+    import fitness_engine
+    from music21 import stream
+    random.seed(0)
+    results = []
+    for mood in fitness_engine.mood_mode_map:
+        parts = generate_markov.create_composition(measures, 0.5).parts
+        pairs = []
+        for i in range(1, measures + 1):
+            composite = stream.Measure(number=i)
+            for part in parts:
+                composite.append(part.measure(i).flatten().notesAndRests.stream())
+            pairs.append((composite, parts[0].measure(i), parts[1].measure(i)))
+
+        start = time.perf_counter()
+        old = [reference_operators.fitness_function(c, mood) + reference_operators.generalFitnessFunction(m1, m2) for c, m1, m2 in pairs]
+        before = time.perf_counter() - start
+        start = time.perf_counter()
+        new = [fitness_engine.fast_fitness_function(c, mood) + fitness_engine.fast_general_fitness(m1, m2) for c, m1, m2 in pairs]
+        after = time.perf_counter() - start
+        assert old == new, f"fitness engine disagrees with fitness_function for {mood}"
+        results.append((mood, before / measures * 1e6, after / measures * 1e6))
+        print(f"{mood:>6}: {results[-1][1]:8.1f} us/measure before, {results[-1][2]:8.1f} us/measure after ({before / after:4.1f}x), scores match")
+    return results
+
+
+"""
+bench_population_fitness
+Input: the number of measures in the population, and how many times it is tiled for the larger runs
+Description: Scores a population measure by measure with the fitness engine and all at once with batch_fitness,
+checks both agree on C and on D# (with a grace note in every fourth measure and a triple flat in every fourth),
+then times batch_fitness as the population grows
+Output: A list of (population size, milliseconds per batch_fitness call) tuples
+"""
+def bench_population_fitness(measures=256, max_tiles=64):
+    import fitness_engine
+    import numpy as np
+    from music21 import note
+    random.seed(0)
+    parts = generate_markov.create_composition(measures, 0.5).parts
+    melodies = [parts[0].measure(i) for i in range(1, measures + 1)]
+    harmonies = [parts[1].measure(i) for i in range(1, measures + 1)]
+    # grace notes have no duration, but fitness_function still scores them
+    for m in melodies[::4]:
+        m.insert(0, note.Note('E4').getGrace())
+    # and the chains have triple flats (G---), whose spellings are past the double sharps of the sharp keys
+    for m in melodies[2::4]:
+        m.insert(0, note.Note('G---4'))
+    encoded = fitness_engine.encode_measures(melodies, harmonies)
+    results = []
+    for mood in fitness_engine.mood_mode_map:
+        for tonic in ('C', 'D#'):
+            single = [fitness_engine.fast_fitness_function(m, mood, tonic) + fitness_engine.fast_fitness_function(h, mood, tonic)
+                      + fitness_engine.fast_general_fitness(m, h) for m, h in zip(melodies, harmonies)]
+            assert np.array_equal(fitness_engine.batch_fitness(*encoded, mood, tonic), single), \
+                f"batch_fitness disagrees for {mood} on {tonic}"
+    print(f"batch_fitness matches the per measure engine on {measures} measures for every mood, on C and D#")
+
+    tiles = 1
+    while tiles <= max_tiles:
+        population = [np.tile(a, (tiles, 1)) for a in encoded]
+        start = time.perf_counter()
+        fitness_engine.batch_fitness(*population, 'happy')
+        elapsed = time.perf_counter() - start
+        results.append((measures * tiles, elapsed * 1000))
+        print(f"{measures * tiles:>7} measures: {elapsed * 1000:8.2f} ms")
+        tiles *= 4
+    return results
+
+
+"""
+bench_genome_operators
+Input: the number of measures to run the operators on
+Description: Runs inversion, crossover and mutate_measure on music21 measures (reference_operators) and on MeasureGenomes
+(genome), and reports the time and the memory allocated by each
+Output: A list of (operator set, milliseconds, KiB allocated) tuples
+"""
+def bench_genome_operators(measures=64):
+    import copy
+    import reference_operators
+    import genome
+    random.seed(0)
+    parts = generate_markov.create_composition(measures, 0.5).parts
+    melodies = [parts[0].measure(i) for i in range(1, measures + 1)]
+    harmonies = [parts[1].measure(i) for i in range(1, measures + 1)]
+    genomes = [genome.from_measures(m, h) for m, h in zip(melodies, harmonies)]
+
+    def with_music21():
+        for i in range(measures - 1):
+            m1 = copy.deepcopy(melodies[i])
+            reference_operators.inversion(m1, harmonies[i])
+            reference_operators.crossover(m1, melodies[i + 1])
+            reference_operators.mutate_measure(m1, 'happy', mutation_rate=0.5)
+
+    def with_genomes():
+        for i in range(measures - 1):
+            genome.inversion(genomes[i])
+            genome.crossover(genomes[i], genomes[i + 1])
+            genome.mutate_measure(genomes[i], 'happy', mutation_rate=0.5)
+
+    results = []
+    for name, run in [('music21', with_music21), ('genome', with_genomes)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append((name, elapsed * 1000, peak / 1024))
+        print(f"{name:>8}: {elapsed * 1000:9.2f} ms, {peak / 1024:9.1f} KiB peak allocated for {measures - 1} rounds")
+    return results
+
+
+"""
+bench_evolution
+Input: the population size, and the most generations to evolve for
+Description: Compares the fitness bought per CPU second by final_piece's recompose-and-select generations and by
+evolving one population with evolution.evolve
+Output: A list of (approach, mean fitness of the kept measures, CPU seconds) tuples
+"""
+def bench_evolution(population_size=256, generations=200):
+    import numpy as np
+    import project
+    import evolution
+    random.seed(0)
+    results = []
+
+    start = time.process_time()
+    selected = project.compose_generations(list(range(8)), mood='happy')
+    kept = [g for best in selected for g in best]
+    elapsed = time.process_time() - start
+    results.append(('recompose', float(evolution.score_population(kept, 'happy').mean()), elapsed))
+
+    start = time.process_time()
+    population = evolution.initial_population(population_size)
+    ranked, fitness, history = evolution.evolve(population, 'happy', generations=generations)
+    elapsed = time.process_time() - start
+    results.append(('evolve', float(np.mean(fitness[:len(kept)])), elapsed))
+    print(f"evolve ran {len(history) - 1} generations, best {history[0]:.2f} -> {history[-1]:.2f}")
+
+    for name, mean, seconds in results:
+        print(f"{name:>10}: mean fitness of {len(kept)} kept measures {mean:6.2f} in {seconds:6.2f} CPU s")
+    return results
+
+
+"""
+bench_incremental_fitness
+Input: the number of measures, the number of notes in each of the long measures, and the generations to evolve
+Description: Changes one note in every measure of a population of long measures, then rescores them in full with
+batch_fitness and incrementally with MeasureFitness.updated, checking both agree. Then does the same for the
+children mutate_measure makes from real measures, by how many notes changed, next to what one child costs in a
+batch (which sets evolution.INCREMENTAL_NOTES), and counts how many mutated children evolve rescores incrementally
+at its default mutation rate and at a low one, checking their scores
+Output: A list of (method, milliseconds) tuples
+"""
+def bench_incremental_fitness(population_size=256, notes=1024, generations=50):
+    import numpy as np
+    import genome
+    import evolution
+    import fitness_engine
+    random.seed(0)
+    rng = np.random.default_rng(0)
+    chords = evolution.initial_population(8)
+    population = []
+    for i in range(population_size):
+        midi = rng.integers(55, 80, notes).astype(np.int16)
+        spelling = np.array([genome.PS_SPELLINGS[m % 12] for m in midi], dtype=np.int16)
+        population.append(chords[i % len(chords)].with_melody(midi, spelling, np.full(notes, 0.25)))
+    scores = evolution.population_fitness(population, 'happy')
+
+    mutated, changed = [], []
+    for g in population:
+        i = int(rng.integers(notes))
+        midi, spelling = g.midi.copy(), g.spelling.copy()
+        midi[i], spelling[i] = random.choice(genome.scale_pitches('happy'))
+        mutated.append(g.with_melody(midi, spelling, g.durations))
+        changed.append([i])
+
+    start = time.perf_counter()
+    full = evolution.score_population(mutated, 'happy')
+    full_time = time.perf_counter() - start
+    start = time.perf_counter()
+    incremental = [s.updated(g.midi, g.spelling, c).total for s, g, c in zip(scores, mutated, changed)]
+    incremental_time = time.perf_counter() - start
+    assert np.array_equal(full, incremental), "incremental fitness disagrees with batch_fitness"
+
+    print(f"{population_size} measures x {notes} notes, one note changed in each:")
+    print(f"       full rescoring: {full_time * 1000:8.2f} ms")
+    print(f"  incremental updates: {incremental_time * 1000:8.2f} ms (scores match)")
+    results = [('full', full_time * 1000), ('incremental', incremental_time * 1000)]
+
+    # real measures, as evolve breeds them
+    population = evolution.initial_population(64)
+    scores = evolution.population_fitness(population, 'happy')
+    by_changed = {}
+    for g, s in zip(population, scores):
+        for _ in range(20):
+            child = genome.mutate_measure(g, 'happy')
+            if len(child) == len(g):
+                c = np.nonzero((child.midi != g.midi) | (child.spelling != g.spelling))[0].tolist()
+                by_changed.setdefault(len(c), []).append((s, child, c))
+    # evolve scores the children it could not update, about 48 of a population of 64, in one batch per generation
+    children = [child for kids in by_changed.values() for _, child, _ in kids]
+    start = time.perf_counter()
+    for i in range(0, len(children), 48):
+        evolution.population_fitness(children[i:i + 48], 'happy')
+    batch_time = (time.perf_counter() - start) / len(children)
+    print(f"{len(children)} mutated children of real measures ({np.mean([len(g) for g in population]):.1f} notes "
+          f"on average), in batches of 48: {batch_time * 1e6:5.1f} us each")
+    for count, kids in sorted(by_changed.items()):
+        start = time.perf_counter()
+        incremental = [s.updated(child.midi, child.spelling, c).total for s, child, c in kids]
+        elapsed = (time.perf_counter() - start) / len(kids)
+        assert np.array_equal(evolution.score_population([child for _, child, _ in kids], 'happy'), incremental), \
+            "incremental fitness disagrees with batch_fitness"
+        results.append((f'{count} changed', elapsed * 1000))
+        print(f"  {count} notes changed: {elapsed * 1e6:5.1f} us each incrementally ({len(kids)} children)")
+
+    # how many mutated children evolve actually rescores incrementally, checking every score breed hands back
+    mutate_measure, updated, breed = genome.mutate_measure, fitness_engine.MeasureFitness.updated, evolution.breed
+    counts = {'mutated': 0, 'updated': 0, 'wrong': 0}
+    def counted_mutate(*args, **kwargs):
+        counts['mutated'] += 1
+        return mutate_measure(*args, **kwargs)
+    def counted_update(self, *args):
+        counts['updated'] += 1
+        return updated(self, *args)
+    def checked_breed(parent1, parent2, fitness1, mood, tonic='C', mutation_rate=0.5):
+        child, score = breed(parent1, parent2, fitness1, mood, tonic, mutation_rate)
+        if score is not None and score.total != evolution.score_population([child], mood, tonic)[0]:
+            counts['wrong'] += 1
+        return child, score
+    genome.mutate_measure, fitness_engine.MeasureFitness.updated, evolution.breed = counted_mutate, counted_update, checked_breed
+    try:
+        for mutation_rate in (0.5, 0.1):
+            counts.update(mutated=0, updated=0)
+            random.seed(0)
+            evolution.evolve(population, 'happy', generations=generations, patience=generations, mutation_rate=mutation_rate)
+            print(f"evolve over {generations} generations, mutation rate {mutation_rate}: {counts['updated']} of "
+                  f"{counts['mutated']} mutated children rescored incrementally")
+            results.append((f'evolve incremental share at {mutation_rate}', counts['updated'] / max(counts['mutated'], 1)))
+    finally:
+        genome.mutate_measure, fitness_engine.MeasureFitness.updated, evolution.breed = mutate_measure, updated, breed
+    assert counts['wrong'] == 0, "incremental fitness disagrees with batch_fitness in evolve"
+    return results
+
+
+"""
+bench_streaming
+Input: the number of measures to stream, and how many measures make up one report window
+Description: Times the first measure of streaming.stream_measures, then the latency and traced memory of every window
+Output: A list of (measures so far, mean milliseconds per measure, traced memory in bytes) tuples
+"""
+def bench_streaming(measures=10000, window=2000):
+    import streaming
+    random.seed(0)
+    start = time.perf_counter()
+    measure_stream = streaming.stream_measures('happy')
+    next(measure_stream)
+    print(f"first measure after {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    results = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for i in range(1, measures + 1):
+        next(measure_stream)
+        if i % window == 0:
+            elapsed = time.perf_counter() - start
+            current, _ = tracemalloc.get_traced_memory()
+            results.append((i, elapsed / window * 1000, current))
+            print(f"{i:>7} measures: {results[-1][1]:6.3f} ms/measure, {current / 1024:8.1f} KiB traced")
+            start = time.perf_counter()
+    tracemalloc.stop()
+    return results
+
+
+"""
+note_events
+Input: a music21 midi.MidiFile
+Description: Collects every note on and note off in the file with its absolute tick, ignoring track and channel layout
+Output: A sorted list of (tick, pitch, is note on, velocity) tuples
+"""
+def note_events(mf):
+    from music21 import midi
+    events = []
+    for track in mf.tracks:
+        tick = 0
+        for e in track.events:
+            if isinstance(e, midi.DeltaTime):
+                tick += e.time
+            elif e.type in (midi.ChannelVoiceMessages.NOTE_ON, midi.ChannelVoiceMessages.NOTE_OFF):
+                on = e.type == midi.ChannelVoiceMessages.NOTE_ON and e.velocity > 0
+                events.append((tick, e.pitch, on, e.velocity if on else 0))
+    return sorted(events)
+
+
+"""
+bench_midi_writer
+Input: how many small pieces to check, and how many measures each has
+Description: Writes the same melody, chords and drums through music21's midi.translate and through midi_writer,
+checks both files hold the same note events, and times the two paths
+Output: A list of (music21 seconds, midi_writer seconds) per piece
+"""
+def bench_midi_writer(pieces=20, measures=4):
+    import evolution
+    import genome
+    import drums
+    import midi_writer
+    from music21 import midi, stream
+    random.seed(0)
+    results = []
+    for _ in range(pieces):
+        population = evolution.initial_population(measures, 0.6)
+        drum_seq = drums.generate_sequence('happy', measures * 2)
+
+        start = time.perf_counter()
+        melody = stream.Part()
+        for g in population:
+            melody.append(genome.to_notes(g))
+        harmony = stream.Part()
+        harmony.append([genome.to_chord_measure(g) for g in population])
+        score = stream.Score()
+        score.insert(0, melody.makeMeasures())
+        score.insert(0, harmony)
+        drum_part = drums.sequence_to_stream(drum_seq)
+        drum_part.makeMeasures(inPlace=True)
+        score.insert(0, drum_part)
+        expected = midi.translate.streamToMidiFile(score)
+        data = expected.writestr()
+        music21_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        melody_track, chord_track = midi_writer.genome_tracks(population, population)
+        data = midi_writer.midi_bytes([melody_track, chord_track, midi_writer.drum_track(drum_seq)])
+        writer_time = time.perf_counter() - start
+
+        written = midi.MidiFile()
+        written.readstr(data)
+        if note_events(written) != note_events(expected):
+            raise AssertionError("midi_writer and music21 disagree on the note events")
+        results.append((music21_time, writer_time))
+
+    music21_mean = sum(r[0] for r in results) / len(results)
+    writer_mean = sum(r[1] for r in results) / len(results)
+    print(f"{pieces} pieces of {measures} measures: same note events; "
+          f"music21 {music21_mean * 1000:.2f} ms, midi_writer {writer_mean * 1000:.3f} ms "
+          f"({music21_mean / writer_mean:.0f}x)")
+    return results
+
+
+"""
+bench_import_time
+Input: how many fresh interpreters to start per module
+Description: Times a cold import of project, generate_markov and drums, each in a new Python process, and checks
+that importing writes no files into the working directory
+Output: A dict from module name to the median import time in seconds
+"""
+def bench_import_time(repeats=5):
+    import subprocess
+    import statistics
+    results = {}
+    for module in ('drums', 'generate_markov', 'project'):
+        before = set(os.listdir('.'))
+        times = []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, '-c', 'import time; t = time.perf_counter(); import ' + module +
+                                  '; print(time.perf_counter() - t)'], capture_output=True, text=True, check=True)
+            times.append(float(out.stdout.strip().splitlines()[-1]))
+        written = set(os.listdir('.')) - before
+        results[module] = statistics.median(times)
+        print(f"{module:>16}: {results[module] * 1000:8.1f} ms median of {repeats}"
+              + (f", wrote {sorted(written)}" if written else ", no files written"))
+    return results
+
+
+"""
+bench_cold_start
+Input: how many times to start the CLI
+Description: Starts python project.py in a fresh process and times how long it takes for the mood prompt to appear
+Output: A list with the seconds until the prompt of every start
+"""
+def bench_cold_start(repeats=5):
+    import subprocess
+    results = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        cli = subprocess.Popen([sys.executable, '-u', 'project.py'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True)
+        for line in cli.stdout:
+            if line.startswith("Enter a mood"):
+                break
+        results.append(time.perf_counter() - start)
+        cli.kill()
+        cli.wait()
+    print(f"mood prompt after {sorted(results)[len(results) // 2] * 1000:.1f} ms (median of {repeats}), "
+          f"fastest {min(results) * 1000:.1f} ms")
+    return results
+
+
+"""
+bench_drum_groove
+Input: the most patterns to generate, and how many times to generate each size
+Description: Checks that generate_groove without jitter puts the same hits at the same times as drum_track does for the
+same patterns, then times generate_groove against generate_sequence + drum_track, doubling the size each step
+Output: A list of (patterns, generate_groove seconds, generate_sequence + drum_track seconds) tuples
+"""
+def bench_drum_groove(largest=16384, repeats=5):
+    import numpy as np
+    import drums
+    import midi_writer
+    rng = np.random.default_rng(0)
+    for mood in drums.GROOVE_RULES:
+        patterns = rng.integers(len(drums.GROOVE_RULES[mood]), size=64)
+        groove = drums.generate_groove(mood, jitter=0, rng=rng, patterns=patterns)
+        seq = [symbol for i in patterns for symbol in drums.GROOVE_RULES[mood][i].split()]
+        track = midi_writer.drum_track(seq)
+        if not (np.allclose(groove.onsets, track.onsets) and np.allclose(groove.durations, track.durations)
+                and list(groove.pitches) == track.pitches):
+            raise AssertionError(f"generate_groove and drum_track disagree for {mood}")
+
+    random.seed(0)
+    results = []
+    size = 16
+    while size <= largest:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            drums.generate_groove('happy', size, rng=rng)
+        vectorized = (time.perf_counter() - start) / repeats
+        start = time.perf_counter()
+        for _ in range(repeats):
+            midi_writer.drum_track(drums.generate_sequence('happy', size))
+        looped = (time.perf_counter() - start) / repeats
+        results.append((size, vectorized, looped))
+        print(f"{size:>6} patterns: generate_groove {vectorized * 1000:8.3f} ms, "
+              f"generate_sequence + drum_track {looped * 1000:8.3f} ms")
+        size *= 2
+    return results
+
+
+"""
+bench_training
+Input: how many files of music21's Bach chorale corpus to train on, and the number of worker processes
+Description: Trains the chord chain on the chorales one by one and then in a process pool, checks both give
+the same merged counts, and times them. Uses music21's own corpus, so no jazz corpus is needed
+Output: The serial and the parallel seconds
+"""
+def bench_training(files=24, workers=None):
+    from music21 import corpus
+    import markov_chord_generation
+    import markov_training
+    paths = [str(p) for p in corpus.getComposer('bach')[:files]]
+
+    start = time.perf_counter()
+    serial, _ = markov_training.train_corpus(paths, markov_chord_generation.extract_chords, 1, progress=False)
+    serial_time = time.perf_counter() - start
+    start = time.perf_counter()
+    parallel, results = markov_training.train_corpus(paths, markov_chord_generation.extract_chords, workers, progress=False)
+    parallel_time = time.perf_counter() - start
+    if parallel != serial:
+        raise AssertionError("the process pool and the serial run counted different transitions")
+
+    slowest = max(results, key=lambda r: r.seconds)
+    print(f"{len(paths)} files, {len(serial)} states: serial {serial_time:.2f} s, "
+          f"{workers or os.cpu_count()} workers {parallel_time:.2f} s; slowest file {slowest.filename} {slowest.seconds:.2f} s")
+    return serial_time, parallel_time
+
+
+"""
+bench_training_cache
+Input: how many files of music21's Bach chorale corpus to train on
+Description: Trains the chord chain with an empty cache, again with the cache filled, and once more with one new
+file added, checking the cached runs count the same transitions as parsing everything
+Output: The seconds of the three runs
+"""
+def bench_training_cache(files=24):
+    import tempfile
+    from music21 import corpus
+    import markov_chord_generation
+    import markov_training
+    paths = [str(p) for p in corpus.getComposer('bach')[:files + 1]]
+    times = []
+    with tempfile.TemporaryDirectory() as folder:
+        cache = markov_training.TrainingCache('chords', os.path.join(folder, 'cache.sqlite'))
+        for label, run in (('empty cache', paths[:files]), ('full cache', paths[:files]), ('one new file', paths)):
+            start = time.perf_counter()
+            counts, results = markov_training.train_corpus(run, markov_chord_generation.extract_chords, 1, False, cache)
+            times.append(time.perf_counter() - start)
+            parsed = sum(1 for r in results if not r.cached)
+            print(f"{label:>12}: {len(run)} files, {parsed} parsed, {times[-1]:.2f} s")
+            if label == 'empty cache':
+                expected = counts
+            elif label == 'full cache' and counts != expected:
+                raise AssertionError("the cached sequences count different transitions")
+        cache.close()
+    return times
+
+
+"""
+bench_key_analysis
+Input: how many files of music21's Bach chorale corpus to extract melodies from
+Description: Times the melody extraction as it was (looking up the key of every note, and analyzing the whole part
+for every note without one) against extract_melody with the key followed once per part, and with no key at all.
+Every chorale is also tried with its key signatures taken out, which is when the old loop analyzed the part for
+every note. All three have to give the same tokens
+Output: A list of (old seconds, once per part seconds, no key seconds) per file
+"""
+def bench_key_analysis(files=8):
+    import tempfile
+    from music21 import corpus, converter, key, note
+    import markov_melody_generation
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        for path in [str(p) for p in corpus.getComposer('bach')[:files]]:
+            score = converter.parse(path)
+            for k in list(score.recurse().getElementsByClass(key.KeySignature)):
+                k.activeSite.remove(k)
+            keyless = os.path.join(folder, os.path.basename(path).replace('.mxl', '-nokey.musicxml'))
+            score.write('musicxml', keyless)
+            paths += [path, keyless]
+
+        for path in paths:
+            converter.parse(path) # parse once first so every run reads music21's parse cache
+
+            start = time.perf_counter()
+            score = converter.parse(path)
+            melody_part = score.parts[0] if len(score.parts) > 0 else score
+            old = []
+            for n in melody_part.flatten().notes:
+                if isinstance(n, note.Note):
+                    local_key = n.getContextByClass(key.Key)
+                    if not local_key:
+                        local_key = melody_part.analyze('key')
+                    old.append(markov_melody_generation.normalize_note(n, local_key))
+            old_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            once = markov_melody_generation.extract_melody(path, uses_key=True)
+            once_time = time.perf_counter() - start
+            start = time.perf_counter()
+            skipped = markov_melody_generation.extract_melody(path, uses_key=False)
+            skipped_time = time.perf_counter() - start
+            if not old == once == skipped:
+                raise AssertionError(f"the melody of {path} changed")
+            results.append((old_time, once_time, skipped_time))
+            print(f"{os.path.basename(path):>24}: {len(old):3d} notes, per note {old_time * 1000:8.1f} ms, "
+                  f"once per part {once_time * 1000:7.1f} ms, no key {skipped_time * 1000:7.1f} ms")
+    return results
+
+"""
+bench_chord_labels
+Input: how many files of music21's Bach chorale corpus to extract chords from
+Description: Times the chord extraction as it was (trimming with max() and naming every chord) against extract_chords
+with its label cache, and checks both give the same figures
+Output: The old seconds, the new seconds, and the label cache hits and misses
+"""
+def bench_chord_labels(files=16):
+    from music21 import corpus, converter
+    import markov_chord_generation
+    paths = [str(p) for p in corpus.getComposer('bach')[:files]]
+    for path in paths:
+        converter.parse(path) # parse once first so both runs read music21's parse cache
+
+    start = time.perf_counter()
+    old = []
+    for path in paths:
+        chords = []
+        for c in converter.parse(path).chordify().recurse().getElementsByClass('Chord'):
+            if len(c.pitches) < 2:
+                continue
+            while len(c.pitches) > 4:
+                c.remove(max(c.pitches))
+            label = markov_chord_generation.extract_chord_label(c)
+            if label:
+                chords.append(label)
+        old.append(chords)
+    old_time = time.perf_counter() - start
+
+    cache = markov_chord_generation.label_cache
+    hits, misses = cache.hits, cache.misses
+    start = time.perf_counter()
+    new = [markov_chord_generation.extract_chords(path)[0] for path in paths]
+    new_time = time.perf_counter() - start
+    if new != old:
+        raise AssertionError("the cached chord labels differ")
+    hits, misses = cache.hits - hits, cache.misses - misses
+    print(f"{len(paths)} files: every chord named {old_time:.2f} s, label cache {new_time:.2f} s "
+          f"({hits} hits, {misses} misses, {hits / max(hits + misses, 1):.0%} hit rate)")
+    return old_time, new_time, hits, misses
+
+"""
+bench_xml_tokens
+Input: how many files of music21's Bach chorale corpus to read (the lead sheets of the corpus are read as well)
+Description: Times the music21 extractors against the streaming ones built on musicxml_tokens, measures the most
+memory each one holds while reading a file with tracemalloc, and checks both give the same melody, and the same
+chords for every score without chord symbols
+Output: The music21 seconds, the streaming seconds, and the peak bytes of each
+"""
+def bench_xml_tokens(files=16):
+    from music21 import corpus, converter
+    import musicxml_tokens
+    import markov_chord_generation
+    import markov_melody_generation
+    paths = [str(p) for p in corpus.getComposer('bach')[:files]]
+    paths += [str(p) for p in corpus.getPaths() if 'leadSheet' in str(p)]
+
+    def music21_tokens(path):
+        converter.parse(path, forceSource=True) # leave music21's parse cache out of it
+        return markov_melody_generation.extract_melody(path), markov_chord_generation.extract_chords(path)[0]
+
+    def streaming_tokens(path):
+        return markov_melody_generation.extract_melody_streaming(path), markov_chord_generation.extract_chords_streaming(path)[0]
+
+    times = []
+    peaks = []
+    for extract in (music21_tokens, streaming_tokens):
+        start = time.perf_counter()
+        tokens = [extract(path) for path in paths]
+        times.append(time.perf_counter() - start)
+        peak = 0
+        for path in paths:
+            tracemalloc.start()
+            extract(path)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        peaks.append(peak)
+        if extract is music21_tokens:
+            expected = tokens
+            continue
+        # lead sheets give their written chord symbols, chordify names the melody note with them
+        bad = [os.path.basename(p) for p, (melody, chords), (old_melody, old_chords) in zip(paths, tokens, expected)
+               if melody != old_melody or (chords != old_chords and not musicxml_tokens.chord_material(p)[0])]
+        if bad:
+            raise AssertionError(f"the streaming tokens differ for {bad}")
+    print(f"{len(paths)} files: music21 {times[0]:.2f} s, peak {peaks[0] / 2**20:.1f} MB; "
+          f"musicxml_tokens {times[1]:.2f} s, peak {peaks[1] / 2**20:.1f} MB ({times[0] / times[1]:.0f}x faster)")
+    return times[0], times[1], peaks[0], peaks[1]
+
+"""
+bench_backoff
+Input: how many files of music21's Bach chorale corpus to use (a quarter of them are held out), the highest order
+to try, and the batch size to time generation with
+Description: Trains melody chains of order 1 up to max_order on the rest of the files and reports for each the
+number of contexts, the size of the text file, how often a held out note comes after a pair of notes the second
+order chain never saw (where the old chain drew from a random state), the bits per held out note under the
+backoff model, and how fast generate_sequences runs. Also checks that the Katz probabilities after a few held out
+histories add up to 1, that next_id and draw pick the same tokens, and that draw picks them that often
+Output: A list of (order, contexts, text bytes, bits per note, tokens per second) tuples
+"""
+def bench_backoff(files=64, max_order=4, batch=1000):
+    import math
+    import tempfile
+    import numpy as np
+    from music21 import corpus
+    import musicxml_tokens
+    import markov_training
+    import compile_markov
+    sequences = [musicxml_tokens.melody_pitches(str(p)) for p in corpus.getComposer('bach')[:files]]
+    held_out = sequences[::4]
+    training = [s for i, s in enumerate(sequences) if i % 4]
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for order in range(1, max_order + 1):
+            counts = {}
+            for tokens in training:
+                markov_training.merge_counts(counts, markov_training.count_transitions(tokens, order))
+            path = os.path.join(folder, f'order{order}.txt')
+            markov_training.write_chain(counts, path)
+            backoff = {}
+            chain = compile_markov.chain_from_dict(compile_markov.load_markov_chain(path, backoff), backoff)
+
+            ids = chain.token_ids
+            bits = []
+            unseen_pairs = 0
+            for tokens in held_out:
+                for i in range(2, len(tokens)):
+                    if tokens[i] not in ids or any(t not in ids for t in tokens[i - order:i]):
+                        continue
+                    unseen_pairs += (tokens[i - 2], tokens[i - 1]) not in counts
+                    history = [ids[t] for t in tokens[max(i - order, 0):i]]
+                    bits.append(-math.log2(max(chain.probability(history, ids[tokens[i]]), 1e-12)))
+
+            rng = np.random.default_rng(order)
+            for tokens in held_out[:4]:
+                history = [ids[t] for t in tokens[:order] if t in ids]
+                p = np.array([chain.probability(history, t) for t in range(len(chain.tokens))])
+                if abs(p.sum() - 1) > 1e-9:
+                    raise AssertionError(f"the order {order} probabilities add up to {p.sum()}")
+                u = rng.random(200000)
+                drawn = chain.draw(np.tile(chain.context_states(history), (len(u), 1)), u)
+                if any(chain.next_id(history, x) != t for x, t in zip(u[:2000].tolist(), drawn[:2000].tolist())):
+                    raise AssertionError(f"next_id and draw disagree for order {order}")
+                if np.abs(np.bincount(drawn, minlength=len(p)) / len(u) - p).max() > 0.01:
+                    raise AssertionError(f"draw does not follow the order {order} probabilities")
+
+            start = time.perf_counter()
+            generate_markov.generate_sequences(chain, 64, batch, seed=0)
+            rate = 64 * batch / (time.perf_counter() - start)
+            results.append((order, len(chain), os.path.getsize(path), sum(bits) / len(bits), rate))
+            print(f"order {order}: {len(chain):5d} contexts, {os.path.getsize(path) / 1024:7.1f} KiB, "
+                  f"{unseen_pairs / len(bits):5.1%} unseen pairs, {np.mean(bits):.3f} bits/note, "
+                  f"{rate / 1e6:5.2f} M tokens/s batched")
+    return results
+
+"""
+bench_chord_vocabulary
+Input: how many chords to build
+Description: Builds the chords of a generated chord sequence by parsing every figure with harmony.ChordSymbol
+(as create_composition did) and from the pitches compiled into the chord chain, and checks both give the same
+pitches. Also times resolving the whole vocabulary, which is paid once when the chain is compiled
+Output: The seconds with figure parsing, the seconds with the compiled pitches, and the seconds to compile them
+"""
+def bench_chord_vocabulary(chords=2000):
+    from music21 import harmony, chord
+    from genome import to_pitch
+    import compile_markov
+    random.seed(0)
+    chain = generate_markov.chord_chain
+    ids = generate_markov.generate_ids(chain, chords)
+
+    start = time.perf_counter()
+    old = []
+    for name in chain.decode(ids):
+        try:
+            old.append(chord.Chord(harmony.ChordSymbol(name).pitches))
+        except Exception:
+            pass
+    parse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = [chord.Chord([to_pitch(m, s) for m, s in zip(*chain.chord(t))]) for t in ids]
+    lookup_time = time.perf_counter() - start
+    if [c.pitches for c in old] != [c.pitches for c in new]:
+        raise AssertionError("the compiled chords differ from the parsed figures")
+
+    start = time.perf_counter()
+    compile_markov.chord_vocabulary(chain.token_names)
+    compile_time = time.perf_counter() - start
+    print(f"{chords} chords: parsing figures {parse_time * 1000:8.1f} ms, compiled pitches {lookup_time * 1000:7.1f} ms "
+          f"({parse_time / lookup_time:4.1f}x); resolving {len(chain.tokens)} figures once {compile_time * 1000:.1f} ms")
+    return parse_time, lookup_time, compile_time
+
+
+BENCHMARKS = {
+    'growth': bench_composition_growth,
+    'assembly': bench_melody_assembly,
+    'batch': bench_batch_sequences,
+    'workers': bench_generation_workers,
+    'fitness': bench_fitness,
+    'population': bench_population_fitness,
+    'genome': bench_genome_operators,
+    'evolve': bench_evolution,
+    'incremental': bench_incremental_fitness,
+    'streaming': bench_streaming,
+    'midi': bench_midi_writer,
+    'imports': bench_import_time,
+    'coldstart': bench_cold_start,
+    'drums': bench_drum_groove,
+    'training': bench_training,
+    'cache': bench_training_cache,
+    'keys': bench_key_analysis,
+    'labels': bench_chord_labels,
+    'xml': bench_xml_tokens,
+    'backoff': bench_backoff,
+    'vocab': bench_chord_vocabulary,
+}
+
+if __name__ == "__main__":
+    # usage: python benchmark.py <name> [args...]
+    name = sys.argv[1] if len(sys.argv) > 1 else 'growth'
+    args = [int(a) for a in sys.argv[2:]]
+    BENCHMARKS[name](*args)
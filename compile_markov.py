@@ -0,0 +1,619 @@
+import os
+import sys
+import json
+import hashlib
+from ast import literal_eval
+from bisect import bisect_right
+from collections.abc import Mapping
+import numpy as np
+
+# A compiled chain file is laid out as
+#   MAGIC | header length (8 bytes, little endian) | JSON header | arrays
+# Every array starts on an ALIGN byte boundary so it can be viewed straight out of the memory map.
+MAGIC = b'MKCHAIN5'
+ALIGN = 64
+CHAIN_FILES = ['melody_markov_output.txt', 'chord_markov_output.txt']
+CHORD_CHAIN = 'chord_markov_output.txt' # compiled with the pitches of its chords
+
+
+"""
+compiled_path
+Input: the filename of a text Markov chain
+Description: Works out where the compiled version of that chain lives
+Output: The filename of the compiled chain
+"""
+def compiled_path(filename):
+    if filename.endswith('.txt'):
+        filename = filename[:-4]
+    return filename + '.chain'
+
+
+"""
+source_digest
+Input: the filename of a text Markov chain
+Description: Hashes the text file so a compiled chain can tell when it is out of date
+Output: The hex digest of the file
+"""
+def source_digest(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+"""
+load_markov_chain
+Input: the name of a file, and optionally a dictionary to fill with the backoff probability of every context
+Description: Converts the file into a dictionary. A context line can end with the probability of backing off
+to the shorter context after the arrow (the trainers write it); a context without one never backs off
+Output: A dictionary from contexts (tuples of the last notes/chords) to dictionaries of next element probabilities
+"""
+def load_markov_chain(filename, backoff=None):
+    with open(filename, 'r') as f:
+        lines = f.readlines()
+    chain = {}
+    current_pair = None
+    for line in lines:
+        line = line.strip()
+        if '→' in line:
+            context, weight = line.split('→')
+            current_pair = literal_eval(context.strip())
+            chain[current_pair] = {}
+            if backoff is not None and weight.strip():
+                backoff[current_pair] = float(weight)
+        elif current_pair is not None:
+            chord, prob = line.split(':')
+            chord = chord.strip()
+            prob = float(prob.strip())
+            chain[current_pair][chord] = prob
+    return chain
+
+
+"""
+CompiledChain
+A variable order Markov chain backed by integer arrays. Every token (note or chord name) gets an id, and every
+context (the last 0 to order tokens) gets a key that spells its token ids in base len(tokens) + 1, so contexts of
+different lengths never share a key and the keys of each order form one sorted block (order_starts[k] is where the
+contexts of length k start). Looking up the contexts of a history is one binary search per order for a batch
+(draw), or one dict lookup per order for a single history (next_id).
+The transitions of state s are next_ids[indptr[s]:indptr[s + 1]] with probabilities probs[indptr[s]:indptr[s + 1]]
+(CSR layout), and backoff[s] is the probability Katz backoff leaves to the next shorter context, lower[s].
+Like Katz backoff, that probability only goes to tokens s never saw, in proportion to their probability after
+lower[s]. The tokens s saw are always among those lower[s] saw (they are counted from the same notes), so after
+backing off from s the draw is either one of lower[s]'s other tokens, with probability spill_share[s], or a token
+lower[s] never saw, which is the same as backing off from lower[s]. The other tokens are the spill transitions
+spill_ids[spill_indptr[s]:spill_indptr[s + 1]], laid out like the transitions with spill_cum like cum_probs.
+A chord chain also holds the pitches of every chord token, resolved when it was compiled: the pitches of token t
+are chord_midi[chord_indptr[t]:chord_indptr[t + 1]] with their spellings (see fitness_engine) in chord_spelling.
+cum_probs holds s plus the running (normalized) probability of each transition, so it increases across
+the whole array and one searchsorted samples any number of states at once in O(log k).
+It can be used like the dictionary of dictionaries that load_markov_chain returns, keyed by context tuples.
+"""
+class CompiledChain(Mapping):
+    tokens: np.ndarray # token id -> token name
+    state_keys: np.ndarray # the key of every context, sorted (so grouped by order)
+    order_starts: np.ndarray # first state of every order 0..order, plus the end of the last one
+    indptr: np.ndarray # start of every state's transitions, plus the end of the last one
+    next_ids: np.ndarray # token id of every transition
+    probs: np.ndarray # probability of every transition
+    cum_probs: np.ndarray # state index + cumulative probability of every transition
+    backoff: np.ndarray # probability of backing off to the shorter context, for every state
+    lower: np.ndarray # the state of the context one token shorter, for every state (-1 for the empty context)
+    spill_share: np.ndarray # once backed off from a state, the chance the draw is one of its spill transitions
+    spill_indptr: np.ndarray # start of every state's spill transitions, plus the end of the last one
+    spill_ids: np.ndarray # token id of every spill transition
+    spill_cum: np.ndarray # state index + cumulative probability of every spill transition
+    chord_indptr: np.ndarray # start of every chord token's pitches, plus the end of the last one (chord chains)
+    chord_midi: np.ndarray # MIDI number of every chord pitch
+    chord_spelling: np.ndarray # spelling of every chord pitch
+
+    def __init__(self, tokens, state_keys, order_starts, indptr, next_ids, probs, cum_probs, backoff,
+                 lower=None, spill_share=None, spill_indptr=None, spill_ids=None, spill_cum=None,
+                 chord_indptr=None, chord_midi=None, chord_spelling=None):
+        self.tokens = tokens
+        self.state_keys = state_keys
+        self.order_starts = order_starts
+        self.indptr = indptr
+        self.next_ids = next_ids
+        self.probs = probs
+        self.cum_probs = cum_probs
+        self.backoff = backoff
+        self.chord_indptr = chord_indptr
+        self.chord_midi = chord_midi
+        self.chord_spelling = chord_spelling
+        self.order = len(order_starts) - 2
+        self.radix = len(tokens) + 1
+        self._token_ids = None
+        self._token_names = None
+        self._contexts = None
+        self._lists = None
+        if lower is None:
+            lower, spill_share, spill_indptr, spill_ids, spill_cum = self.backoff_spill()
+        self.lower = lower
+        self.spill_share = spill_share
+        self.spill_indptr = spill_indptr
+        self.spill_ids = spill_ids
+        self.spill_cum = spill_cum
+
+    @property
+    def token_ids(self):
+        # only built the first time a name has to be turned back into an id
+        if self._token_ids is None:
+            self._token_ids = {str(t): i for i, t in enumerate(self.tokens)}
+        return self._token_ids
+
+    @property
+    def token_names(self):
+        # plain python strings, which are much quicker to hand out than numpy ones
+        if self._token_names is None:
+            self._token_names = self.tokens.tolist()
+        return self._token_names
+
+    @property
+    def lists(self):
+        # the state of every context key and the arrays next_id needs, as plain python objects (built on first use)
+        if self._lists is None:
+            self._lists = ({key: s for s, key in enumerate(self.state_keys.tolist())}, self.indptr.tolist(),
+                           self.cum_probs.tolist(), self.next_ids.tolist(), self.backoff.tolist(), self.lower.tolist(),
+                           self.spill_share.tolist(), self.spill_indptr.tolist(), self.spill_cum.tolist(),
+                           self.spill_ids.tolist())
+        return self._lists
+
+    def backoff_spill(self):
+        # works out lower, spill_share and the spill transitions (see the class description) from the transitions
+        lower = np.full(len(self.state_keys), -1, dtype=np.int32)
+        for k in range(1, self.order + 1):
+            start, end = int(self.order_starts[k]), int(self.order_starts[k + 1])
+            # dropping the oldest tokens of a context drops the highest digits of its key; the old second order
+            # files have no first order contexts, so those back off straight to the empty context
+            for j in range(k - 1, -1, -1):
+                missing = lower[start:end] < 0
+                lower[start:end][missing] = self.find_keys(self.state_keys[start:end][missing] % self.radix ** j, j)
+        indptr, cum_probs, next_ids = self.indptr.tolist(), self.cum_probs.tolist(), self.next_ids.tolist()
+        backoff = self.backoff.tolist()
+        share = np.zeros(len(self.state_keys), dtype=np.float64)
+        spill_indptr = np.zeros(len(self.state_keys) + 1, dtype=np.int32)
+        spill_ids, spill_cum = [], []
+        for s in range(len(self.state_keys)):
+            l = int(lower[s])
+            if backoff[s] > 0 and l >= 0:
+                saw = set(next_ids[indptr[s]:indptr[s + 1]])
+                spill = []
+                for i in range(indptr[l], indptr[l + 1]):
+                    if next_ids[i] not in saw:
+                        spill.append((next_ids[i], cum_probs[i] - (cum_probs[i - 1] if i > indptr[l] else l)))
+                rest = sum(p for _, p in spill)
+                # Katz's alpha: lower's probability of the tokens s saw is taken out and the rest scaled back up
+                left = 1 - (1 - backoff[l]) * (1 - rest)
+                share[s] = (1 - backoff[l]) * rest / left if left > 0 else 0.0
+                running = 0.0
+                for t, p in spill:
+                    running += p
+                    spill_ids.append(t)
+                    spill_cum.append(s + running / rest)
+                if spill:
+                    spill_cum[-1] = s + 1.0
+            spill_indptr[s + 1] = len(spill_ids)
+        return (lower, share, spill_indptr, np.array(spill_ids, dtype=np.int32),
+                np.array(spill_cum, dtype=np.float64))
+
+    def next_id(self, history, u):
+        # draw for a single history (token ids, oldest first) in plain python: one dict lookup per order to find the
+        # longest context that was seen, then a binary search in the transitions it settles on. Gives the same
+        # token as draw
+        states, indptr, cum_probs, next_ids, backoff, lower, share, spill_indptr, spill_cum, spill_ids = self.lists
+        s = states.get(0, -1)
+        key = 0
+        scale = 1
+        for t in reversed(history[len(history) - min(self.order, len(history)):]):
+            key += (t + 1) * scale
+            scale *= self.radix
+            s = states.get(key, s)
+        if s < 0:
+            return -1
+        keep = 1 - backoff[s]
+        if u < keep:
+            return next_ids[bisect_right(cum_probs, s + u / keep, indptr[s], indptr[s + 1])]
+        u = (u - keep) / backoff[s]
+        while lower[s] >= 0:
+            if u < share[s]:
+                return spill_ids[bisect_right(spill_cum, s + u / share[s], spill_indptr[s], spill_indptr[s + 1])]
+            u = (u - share[s]) / (1 - share[s])
+            s = lower[s]
+        return -1
+
+    def find_keys(self, keys, k):
+        # the states of the order k contexts with these keys, -1 where the context was never seen
+        start, end = int(self.order_starts[k]), int(self.order_starts[k + 1])
+        keys = np.asarray(keys, dtype=np.int64)
+        if start == end:
+            return np.full(keys.shape, -1, dtype=np.int64)
+        s = start + np.minimum(np.searchsorted(self.state_keys[start:end], keys), end - start - 1)
+        return np.where(self.state_keys[s] == keys, s, -1)
+
+    def context_states(self, history):
+        # history holds token ids, oldest first, in its last axis (one history or a whole batch of them).
+        # Gives the state of the context of every length 0..order that ends at the last token, -1 where unseen
+        history = np.asarray(history, dtype=np.int64)
+        keys = np.zeros(history.shape[:-1], dtype=np.int64)
+        states = np.full(history.shape[:-1] + (self.order + 1,), -1, dtype=np.int64)
+        states[..., 0] = self.find_keys(keys, 0)
+        for k in range(1, min(self.order, history.shape[-1]) + 1):
+            keys = keys + (history[..., -k] + 1) * self.radix ** (k - 1)
+            states[..., k] = self.find_keys(keys, k)
+        return states
+
+    def context_ids(self, s):
+        # the token ids of the context of state s (or of an array of states of the same order)
+        keys = np.asarray(self.state_keys[s], dtype=np.int64)
+        ids = []
+        while np.any(keys):
+            keys, digit = np.divmod(keys, self.radix)
+            ids.append(digit - 1)
+        return np.stack(ids[::-1], axis=-1) if ids else np.zeros(keys.shape + (0,), dtype=np.int64)
+
+    def state_index(self, context):
+        ids = self.token_ids
+        if len(context) > self.order or any(t not in ids for t in context):
+            return -1
+        key = 0
+        for t in context:
+            key = key * self.radix + ids[t] + 1
+        return int(self.find_keys(key, len(context)))
+
+    def sample(self, cum, ids, states, u):
+        # u is uniform in [0, 1) for every state; the transition taken (from the cum_probs and next_ids layout,
+        # or the spill one) is the first one whose cumulative probability is past u
+        t = np.searchsorted(cum, np.add(states, u), side='right')
+        return ids[t]
+
+    def random_state(self, u):
+        # a random context of the highest order, to start a sequence from
+        start, end = self.order_starts[-2], self.order_starts[-1]
+        return start + (np.asarray(u) * (end - start)).astype(np.int64)
+
+    def draw(self, states, u):
+        # states come from context_states and u is uniform in [0, 1) for each of them. The longest context that was
+        # seen picks one of its transitions with probability 1 - backoff; otherwise u is stretched back over [0, 1)
+        # and picks a spill transition with probability spill_share, or is stretched again and moves on to the
+        # next shorter context's spill transitions, so one number serves every order
+        states = np.asarray(states, dtype=np.int64)
+        shape = states.shape[:-1]
+        states = states.reshape(-1, self.order + 1)
+        u = np.array(u, dtype=np.float64).reshape(-1)
+        out = np.full(len(u), -1, dtype=np.int64)
+        s = np.full(len(u), -1, dtype=np.int64)
+        for k in range(self.order + 1):
+            s = np.where(states[:, k] >= 0, states[:, k], s) # the longest context that was seen
+        pending = np.nonzero(s >= 0)[0]
+        s = s[pending]
+
+        keep = 1 - self.backoff[s]
+        taken = u[pending] < keep
+        here = pending[taken]
+        out[here] = self.sample(self.cum_probs, self.next_ids, s[taken], u[here] / keep[taken])
+        pending, s = pending[~taken], s[~taken]
+        u[pending] = (u[pending] - keep[~taken]) / self.backoff[s]
+        while len(pending):
+            backed = self.lower[s] >= 0
+            pending, s = pending[backed], s[backed]
+            share = self.spill_share[s]
+            taken = u[pending] < share
+            here = pending[taken]
+            out[here] = self.sample(self.spill_cum, self.spill_ids, s[taken], u[here] / share[taken])
+            pending, s, share = pending[~taken], s[~taken], share[~taken]
+            u[pending] = (u[pending] - share) / (1 - share)
+            s = self.lower[s]
+        return out.reshape(shape)
+
+    def probability(self, history, token):
+        # the probability that draw picks token id after the history, worked out with Katz's formula rather than
+        # the spill transitions: a context gives a token it saw its own discounted probability, and every other
+        # token alpha times its probability after the shorter context, where alpha spreads the backoff probability
+        # over just the tokens the context did not see
+        found = [s for s in self.context_states(history)[::-1].tolist() if s >= 0]
+        known = {}
+        def katz(level, t):
+            if (level, t) not in known:
+                s = found[level]
+                start, end = self.indptr[s], self.indptr[s + 1]
+                here = np.nonzero(self.next_ids[start:end] == t)[0]
+                if len(here):
+                    i = start + here[0]
+                    p = (1 - self.backoff[s]) * (self.cum_probs[i] - (self.cum_probs[i - 1] if i > start else s))
+                elif self.backoff[s] == 0 or level + 1 == len(found):
+                    p = 0.0
+                else:
+                    left = 1 - sum(katz(level + 1, v) for v in self.next_ids[start:end].tolist())
+                    p = self.backoff[s] * katz(level + 1, t) / left if left > 0 else 0.0
+                known[(level, t)] = float(p)
+            return known[(level, t)]
+        return katz(0, token) if found else 0.0
+
+    def chord(self, t):
+        # the MIDI numbers and spellings of the pitches of chord token t
+        start, end = self.chord_indptr[t], self.chord_indptr[t + 1]
+        return self.chord_midi[start:end], self.chord_spelling[start:end]
+
+    def decode(self, ids):
+        names = self.token_names
+        return [names[i] for i in ids]
+
+    def transitions(self, s):
+        start, end = self.indptr[s], self.indptr[s + 1]
+        return {self.token_names[t]: float(p) for t, p in zip(self.next_ids[start:end], self.probs[start:end])}
+
+    def __getitem__(self, context):
+        s = self.state_index(context)
+        if s < 0:
+            raise KeyError(context)
+        return self.transitions(s)
+
+    def __contains__(self, context):
+        return self.state_index(context) >= 0
+
+    def __iter__(self):
+        if self._contexts is None:
+            self._contexts = [tuple(self.decode(self.context_ids(s))) for s in range(len(self.state_keys))]
+        return iter(self._contexts)
+
+    def __len__(self):
+        return len(self.state_keys)
+
+
+"""
+chord_vocabulary
+Input: a list of chord figures
+Description: Parses every figure into a music21 chord symbol, once, when the chain is compiled
+Output: A dict from every figure that could be parsed (into at least one pitch) to the MIDI numbers and
+spellings of its pitches
+"""
+def chord_vocabulary(figures):
+    from music21 import harmony
+    from fitness_engine import spelling_of
+    vocabulary = {}
+    for figure in figures:
+        try:
+            pitches = harmony.ChordSymbol(figure).pitches
+        except Exception:
+            continue
+        if pitches:
+            vocabulary[figure] = ([int(p.ps) for p in pitches], [spelling_of(p) for p in pitches])
+    return vocabulary
+
+
+"""
+prune_tokens
+Input: A dictionary of dictionaries containing a Markov chain, and the tokens to keep
+Description: Leaves out every transition to a token that is not kept and every context with one in it.
+Contexts with no transitions left are left out too
+Output: The pruned dictionary of dictionaries
+"""
+def prune_tokens(chain, keep):
+    pruned = {}
+    for context, transitions in chain.items():
+        if all(t in keep for t in context):
+            transitions = {name: prob for name, prob in transitions.items() if name in keep}
+            if transitions:
+                pruned[context] = transitions
+    return pruned
+
+
+"""
+chain_names
+Input: A dictionary of dictionaries containing a Markov chain
+Description: Collects every token that appears in a context or as a next token
+Output: A set of token names
+"""
+def chain_names(chain):
+    names = set()
+    for context, transitions in chain.items():
+        names.update(context)
+        names.update(transitions)
+    return names
+
+
+"""
+chain_from_dict
+Input: A dictionary from contexts (tuples of 0 to order notes/chords) to dictionaries of transition
+probabilities, optionally the backoff probability of every context (0 for the ones left out), and whether it
+is a chord chain
+Description: Gives every note/chord an id and packs the transitions into CSR arrays, keyed by context. A chain
+without the empty context (like the old second order files) gets one, made from how likely every token is
+to come next over all the contexts, so any history has somewhere to back off to. The figures of a chord chain
+are parsed into pitches here (see chord_vocabulary), and the ones music21 cannot parse are pruned, so
+generation never has to parse or skip a chord
+Output: A CompiledChain
+"""
+def chain_from_dict(chain, backoff=None, chords=False):
+    backoff = backoff or {}
+    if chords:
+        vocabulary = chord_vocabulary(sorted(chain_names(chain)))
+        chain = prune_tokens(chain, vocabulary)
+    names = chain_names(chain)
+    tokens = np.array(sorted(names))
+    ids = {t: i for i, t in enumerate(tokens.tolist())}
+    radix = len(tokens) + 1
+    order = max((len(context) for context in chain), default=0)
+    if radix ** order >= 2 ** 63:
+        raise ValueError(f"an order {order} chain of {len(tokens)} tokens is too big to key")
+
+    if () not in chain:
+        unigram = {}
+        for transitions in chain.values():
+            for name, prob in transitions.items():
+                unigram[name] = unigram.get(name, 0) + prob
+        chain = {(): unigram, **chain}
+
+    def context_key(context):
+        key = 0
+        for t in context:
+            key = key * radix + ids[t] + 1
+        return key
+
+    states = sorted(chain, key=context_key)
+    state_keys = np.array([context_key(c) for c in states], dtype=np.int64)
+    order_starts = np.searchsorted([len(c) for c in states], np.arange(order + 2)).astype(np.int32)
+    indptr = np.zeros(len(states) + 1, dtype=np.int32)
+    next_ids = []
+    probs = []
+    for s, state in enumerate(states):
+        for name, prob in chain[state].items():
+            next_ids.append(ids[name])
+            probs.append(prob)
+        indptr[s + 1] = len(next_ids)
+    probs = np.array(probs, dtype=np.float64)
+    arrays = {}
+    if chords:
+        pitches = [vocabulary[t] for t in tokens.tolist()]
+        arrays['chord_indptr'] = np.concatenate(([0], np.cumsum([len(m) for m, _ in pitches]))).astype(np.int32)
+        arrays['chord_midi'] = np.array([m for midi, _ in pitches for m in midi], dtype=np.int16)
+        arrays['chord_spelling'] = np.array([s for _, spelling in pitches for s in spelling], dtype=np.int16)
+    return CompiledChain(tokens, state_keys, order_starts, indptr, np.array(next_ids, dtype=np.int32), probs,
+                         cumulative_probs(indptr, probs), np.array([backoff.get(c, 0.0) for c in states], dtype=np.float64),
+                         **arrays)
+
+
+"""
+cumulative_probs
+Input: the CSR indptr of a chain, and the probability of every transition
+Description: Normalizes each state's probabilities (the text files round them, so they rarely add up to 1)
+and offsets the running total of state s by s
+Output: The cum_probs array of a CompiledChain
+"""
+def cumulative_probs(indptr, probs):
+    cum = np.empty(len(probs), dtype=np.float64)
+    for s in range(len(indptr) - 1):
+        start, end = indptr[s], indptr[s + 1]
+        row = probs[start:end]
+        total = row.sum()
+        # a state whose probabilities all rounded to 0 picks uniformly
+        row = np.cumsum(row / total if total > 0 else np.full(len(row), 1 / len(row)))
+        row[-1] = 1.0
+        cum[start:end] = s + row
+    return cum
+
+
+"""
+write_compiled_chain
+Input: A CompiledChain, the filename to write to, and the digest of the text file it came from
+Description: Writes the chain's arrays into a single file that can be memory mapped
+Output: None
+"""
+def write_compiled_chain(chain, filename, digest=''):
+    arrays = {
+        'tokens': chain.tokens,
+        'state_keys': chain.state_keys,
+        'order_starts': chain.order_starts,
+        'indptr': chain.indptr,
+        'next_ids': chain.next_ids,
+        'probs': chain.probs,
+        'cum_probs': chain.cum_probs,
+        'backoff': chain.backoff,
+        'lower': chain.lower,
+        'spill_share': chain.spill_share,
+        'spill_indptr': chain.spill_indptr,
+        'spill_ids': chain.spill_ids,
+        'spill_cum': chain.spill_cum,
+    }
+    if chain.chord_indptr is not None:
+        arrays.update(chord_indptr=chain.chord_indptr, chord_midi=chain.chord_midi, chord_spelling=chain.chord_spelling)
+    header = {'source_digest': digest, 'arrays': {}}
+    offset = 0
+    for name, arr in arrays.items():
+        header['arrays'][name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset += -(-arr.nbytes // ALIGN) * ALIGN
+    header_bytes = json.dumps(header).encode('utf-8')
+    # pad so the first array is aligned in the file too
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGN) * ALIGN
+    header_bytes += b' ' * (data_start - len(MAGIC) - 8 - len(header_bytes))
+
+    # written next to the target and renamed over it, so a process loading the chain at the same time sees either
+    # the old file or the whole new one, and keeps its memory map of the old one
+    temp = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(temp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for name, arr in arrays.items():
+                data = np.ascontiguousarray(arr).tobytes()
+                f.write(data)
+                f.write(b'\0' * (-len(data) % ALIGN))
+        os.replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+"""
+read_header
+Input: the filename of a compiled chain
+Description: Reads the JSON header at the front of the file
+Output: The header dictionary, and the byte offset where the arrays begin
+"""
+def read_header(filename):
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a compiled Markov chain")
+        length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(length))
+    return header, len(MAGIC) + 8 + length
+
+
+"""
+load_compiled_chain
+Input: the filename of a compiled chain
+Description: Memory maps the file, so loading costs almost nothing and processes share the pages
+Output: A CompiledChain whose arrays are read only views into the file
+"""
+def load_compiled_chain(filename):
+    header, data_start = read_header(filename)
+    buf = np.memmap(filename, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        count = int(np.prod(info['shape'], dtype=np.int64))
+        start = data_start + info['offset']
+        arrays[name] = buf[start:start + count * dtype.itemsize].view(dtype).reshape(info['shape'])
+    return CompiledChain(**arrays)
+
+
+"""
+compile_markov_chain
+Input: the filename of a text Markov chain, optionally where to write the compiled chain, and whether it is a chord
+chain (by default, whether it is CHORD_CHAIN)
+Description: Converts the text output of the trainers into the compiled format
+Output: The filename of the compiled chain
+"""
+def compile_markov_chain(filename, output=None, chords=None):
+    output = output or compiled_path(filename)
+    backoff = {}
+    if chords is None:
+        chords = os.path.basename(filename) == CHORD_CHAIN
+    chain = chain_from_dict(load_markov_chain(filename, backoff), backoff, chords)
+    write_compiled_chain(chain, output, source_digest(filename))
+    return output
+
+
+"""
+is_up_to_date
+Input: the filename of a text Markov chain
+Description: Checks that a compiled chain exists and was built from the current text file. When only the
+compiled chain was shipped there is nothing to compare it with, so it is used as it is
+Output: True if the compiled chain can be used in place of the text file
+"""
+def is_up_to_date(filename):
+    try:
+        header, _ = read_header(compiled_path(filename))
+    except (OSError, ValueError):
+        return False
+    if not os.path.exists(filename):
+        return True
+    return header.get('source_digest') == source_digest(filename)
+
+
+if __name__ == "__main__":
+    # usage: python compile_markov.py [chain.txt ...]
+    for filename in sys.argv[1:] or CHAIN_FILES:
+        output = compile_markov_chain(filename)
+        print(f"Compiled {filename} -> {output}")
@@ -1,5 +1,8 @@
-from music21 import *
+import sys
 import random
+from functools import lru_cache
+import numpy as np
+import midi_writer
 
 
 # General MIDI Drum Map 
@@ -24,6 +27,9 @@ GROOVE_RULES = {
     ]
 }
 
+SWING_RATIO = 0.67 # share of the beat the first eighth of a swung pair gets
+SWING_JITTER = 0.015 # most a hit is moved off the grid, in beats (the jitter of get_swing_duration)
+
 # Helper Functions
 """
 get_swing_duration
@@ -67,6 +73,54 @@ def generate_sequence(emotion, num_measures=4):
     return sequence
 
 
+"""
+groove_table
+Input: the given mood
+Description: Turns the mood's groove patterns into a table of MIDI pitches, once per mood
+Output: An array with one row of 4 pitches per pattern, -1 for rests
+"""
+@lru_cache(maxsize=None)
+def groove_table(emotion):
+    return np.array([[-1 if PERC_MAP[symbol] is None else PERC_MAP[symbol] for symbol in pattern.split()]
+                     for pattern in GROOVE_RULES[emotion]], dtype=np.int16)
+
+
+"""
+generate_groove
+Input: the given mood, the number of patterns (like generate_sequence), whether there's a swing beat, the swing ratio,
+the timing jitter in beats, a NumPy random generator, and optionally the index of every pattern instead of random ones
+Description: Builds the whole groove at once as arrays. Every eighth note slot is placed on the grid (swung by swing_ratio)
+and then moved by up to jitter beats. Unlike get_swing_duration the jitter does not add up from note to note, so long
+grooves do not drift off the beat. Velocities follow get_velocity, with the position counted within each pattern
+Output: A midi_writer.NoteTrack on the drum channel, holding NumPy arrays
+"""
+def generate_groove(emotion, num_measures=4, swing=True, swing_ratio=SWING_RATIO, jitter=SWING_JITTER, rng=None, patterns=None):
+    if rng is None:
+        rng = np.random.default_rng(random.getrandbits(32))
+    table = groove_table(emotion)
+    if patterns is None:
+        patterns = rng.integers(len(table), size=num_measures)
+    pitches = table[patterns].ravel()
+    slots = len(pitches)
+
+    ratio = swing_ratio if swing else 0.5
+    grid = np.arange(slots + 1) // 2 + np.where(np.arange(slots + 1) % 2 == 1, ratio, 0.0)
+    if jitter:
+        grid = np.maximum(grid + rng.uniform(-jitter, jitter, size=slots + 1), 0.0) # nothing before the downbeat
+    onsets = grid[:-1]
+    durations = np.diff(grid)
+
+    position = np.arange(slots) % 4
+    velocities = np.full(slots, 64, dtype=np.int16)
+    soft = rng.integers(60, 71, size=slots)
+    velocities = np.where(pitches == PERC_MAP['H'], soft, velocities)
+    velocities = np.where(pitches == PERC_MAP['S'], np.where(position == 1, 85, soft), velocities)
+    velocities = np.where(pitches == PERC_MAP['K'], rng.integers(75, 91, size=slots), velocities)
+
+    hits = pitches >= 0
+    return midi_writer.NoteTrack(midi_writer.DRUM_CHANNEL, None, onsets[hits], durations[hits], pitches[hits], velocities[hits])
+
+
 """
 sequence_to_stream
 Input: A given sequence, a boolean based on whether or not there's a swing beat, and whether or not we are exporting for musescore
@@ -74,6 +128,7 @@ Description: Convert a sequence to a music21 stream
 Output: The music21 stream
 """
 def sequence_to_stream(seq, swing=True, for_score=False):
+    from music21 import stream, instrument, expressions, note
     part = stream.Part()
     part.id = "Percussion"
     instr = instrument.Woodblock()  # Generic unpitched
@@ -111,24 +166,63 @@ def sequence_to_stream(seq, swing=True, for_score=False):
 
     return part
 
+"""
+groove_to_stream
+Input: a groove from generate_groove
+Description: Convert the groove to a music21 stream, keeping its swing, timing and velocities
+Output: The music21 stream
+"""
+def groove_to_stream(groove):
+    from music21 import stream, instrument, note
+    part = stream.Part()
+    part.id = "Percussion"
+    instr = instrument.Woodblock()  # Generic unpitched
+    instr.midiChannel = 9  # Channel 10 for percussion
+    part.insert(0, instr)
+
+    for onset, duration, midi_pitch, velocity in zip(groove.onsets.tolist(), groove.durations.tolist(),
+                                                    groove.pitches.tolist(), groove.velocities.tolist()):
+        n = note.Note()
+        n.pitch.midi = midi_pitch
+        n.duration.quarterLength = duration
+        n.volume.velocity = velocity
+        n.isPercussion = True
+        n.storedInstrument = instr
+        n.channel = 9  # Channel 10 (zero indexed)
+        part.insert(onset, n)
+
+    return part
+
 """
 export_midi
 Input: A music21 part, and filename
 Description: Export the part to a midi file
 """
 def export_midi(part, filename="swing_groove.mid"):
+    from music21 import midi
     mf = midi.translate.streamToMidiFile(part)
     mf.open(filename, 'wb')
     mf.write()
     mf.close()
     print(f"Midi exported: {filename}")
 
+"""
+export_sequence_midi
+Input: A drum sequence, filename, a boolean based on whether or not there's a swing beat, optional velocities
+and timing offsets per symbol, and the tempo
+Description: Writes the sequence straight to a midi file, skipping the music21 stream and its translation
+"""
+def export_sequence_midi(seq, filename="swing_groove.mid", swing=True, velocities=None, offsets=None, bpm=120):
+    midi_writer.write_midi_file(filename, [midi_writer.drum_track(seq, swing, velocities, offsets)], bpm)
+    print(f"Midi exported: {filename}")
+
 """
 export_score
 Input: A music21 part, and filename
 Description: Export the part to a musicxml file
 """
 def export_score(part, filename="swing_score.xml"):
+    from music21 import stream, metadata
     # Add metadata so MuseScore opens cleanly
     score = stream.Score()
     score.append(part)
@@ -139,17 +233,16 @@ def export_score(part, filename="swing_score.xml"):
     print(f"MusicXML score exported: {filename}")
 
 # RUN STUFF
-
-# Example: Generate an angry swing groove
-emotion = 'angry'
-sequence = generate_sequence(emotion, num_measures=4)
-
-# Create versions
-midi_part = sequence_to_stream(sequence, swing=True, for_score=False)
-score_part = sequence_to_stream(sequence, swing=False, for_score=True)
-
-# Export both
-export_midi(midi_part, "swing_groove.midi")
-export_score(score_part, "swing_score.xml")
-
-
+if __name__ == "__main__":
+    # usage: python drums.py [mood] [measures]
+    # Example: Generate an angry swing groove
+    emotion = sys.argv[1] if len(sys.argv) > 1 else 'angry'
+    num_measures = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    sequence = generate_sequence(emotion, num_measures=num_measures)
+
+    # Create the score version (the midi is written straight from the sequence)
+    score_part = sequence_to_stream(sequence, swing=False, for_score=True)
+
+    # Export both
+    export_sequence_midi(sequence, "swing_groove.midi", swing=True)
+    export_score(score_part, "swing_score.xml")
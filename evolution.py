@@ -0,0 +1,166 @@
+import random
+import numpy as np
+import generate_markov
+import genome
+from fitness_engine import batch_fitness, measure_fitnesses
+
+# Chance of each operator when breeding, the same split final_piece uses
+INVERSION_RATE = 0.25
+MUTATION_RATE = 0.50
+CROSSOVER_RATE = 0.80
+MIN_GAIN = 1e-9 # smallest rise in the best fitness that still counts as progress
+# A mutated child is rescored incrementally when at most INCREMENTAL_NOTES of its notes changed. Measures are
+# about 3 notes, and scoring one more child in the next NumPy batch costs about as much as rescoring one note
+# (see bench_incremental_fitness), so past that the batch is quicker.
+INCREMENTAL_NOTES = 1
+
+
+"""
+initial_population
+Input: the number of measures in the population, and the probability of subdividing a beat
+Description: Composes one long piece with the Markov chains and turns every measure into a genome
+Output: A list of MeasureGenomes
+"""
+def initial_population(size, prob=0.5):
+    parts = generate_markov.create_composition(size, prob).parts
+    return [genome.from_measures(parts[0].measure(i + 1), parts[1].measure(i + 1)) for i in range(size)]
+
+
+"""
+score_population
+Input: a list of MeasureGenomes, the mood, and the tonic
+Description: Scores every genome with fitness_function + generalFitnessFunction, all in one batch
+Output: An array with the fitness of every genome
+"""
+def score_population(population, mood, tonic='C'):
+    return batch_fitness(*genome.encode_population(population), mood, tonic)
+
+
+"""
+population_fitness
+Input: a list of MeasureGenomes, the mood, and the tonic
+Description: Like score_population, but keeps the per note contributions so mutated children can be rescored incrementally
+Output: A list of fitness_engine.MeasureFitness, one per genome
+"""
+def population_fitness(population, mood, tonic='C'):
+    return measure_fitnesses(*genome.encode_population(population), [len(g) for g in population], mood, tonic)
+
+
+"""
+select_parents
+Input: the fitness of the population, how many parents to pick, 'tournament' or 'roulette', the tournament size,
+and a NumPy random generator
+Description: Tournament selection keeps the fittest of tournament_size random genomes; roulette picks
+genomes with probability proportional to their fitness
+Output: An array with the index of every parent
+"""
+def select_parents(fitness, count, selection, tournament_size, rng):
+    if selection == 'tournament':
+        entrants = rng.integers(len(fitness), size=(count, tournament_size))
+        return entrants[np.arange(count), np.argmax(fitness[entrants], axis=1)]
+    if selection == 'roulette':
+        total = fitness.sum()
+        weights = fitness / total if total > 0 else None
+        return rng.choice(len(fitness), size=count, p=weights)
+    raise ValueError(f"Unsupported selection: {selection}")
+
+
+"""
+breed
+Input: two parent genomes, the fitness of the first parent, the mood, the tonic, and the mutation rate per note
+Description: Makes one child with inversion, mutate_measure or crossover, or copies the first parent.
+A child with only a few mutated notes has just those notes rescored; the others have to be scored in full
+Output: The child genome, and its MeasureFitness (None when it still needs scoring)
+"""
+def breed(parent1, parent2, fitness1, mood, tonic='C', mutation_rate=0.5):
+    operation = random.random()
+    if operation <= INVERSION_RATE:
+        return genome.inversion(parent1), None
+    elif operation <= MUTATION_RATE:
+        child = genome.mutate_measure(parent1, mood, tonic, mutation_rate=mutation_rate)
+        if len(child) != len(parent1):
+            # parent1 had rests, which mutate_measure drops, so the notes moved
+            return child, None
+        # compared as plain ints, which is quicker than NumPy at a few notes
+        changed = [i for i, (a, b, c, d) in enumerate(zip(child.midi.tolist(), parent1.midi.tolist(),
+                                                           child.spelling.tolist(), parent1.spelling.tolist()))
+                   if a != b or c != d]
+        if len(changed) > INCREMENTAL_NOTES:
+            return child, None
+        return child, fitness1.updated(child.midi, child.spelling, changed)
+    elif operation <= CROSSOVER_RATE:
+        child = genome.crossover(parent1, parent2)[0]
+        # a note held across the split beat makes a child longer or shorter than a measure; the population
+        # would drift towards longer measures (more notes, more points), so such children are dropped
+        if child.durations.sum() == parent1.durations.sum():
+            return child, None
+    return parent1, fitness1
+
+
+"""
+evolve
+Input: the starting population, the mood, the tonic, the most generations to run, how many of the best genomes
+survive unchanged (elitism), the selection method, the tournament size, how many generations without
+improvement end the run early, and the chance of mutating each note
+Description: A genetic algorithm: the population carries over from generation to generation, the elite are kept,
+and the rest of the next generation is bred from selected parents. Randomness comes from the random module,
+so random.seed makes a run repeatable
+Output: The final population sorted from fittest down, its fitness, and the best fitness after every generation
+"""
+def evolve(population, mood, tonic='C', generations=100, elite=2, selection='tournament', tournament_size=3, patience=15, mutation_rate=0.5):
+    rng = np.random.default_rng(random.getrandbits(32))
+    population = list(population)
+    scores = population_fitness(population, mood, tonic)
+    fitness = np.array([s.total for s in scores])
+    history = [float(fitness.max())]
+    stale = 0
+
+    for _ in range(generations):
+        order = np.argsort(-fitness, kind='stable')
+        children = [population[i] for i in order[:elite]]
+        child_scores = [scores[i] for i in order[:elite]]
+        parents = select_parents(fitness, 2 * (len(population) - len(children)), selection, tournament_size, rng)
+        for a, b in parents.reshape(-1, 2):
+            child, score = breed(population[a], population[b], scores[a], mood, tonic, mutation_rate)
+            children.append(child)
+            child_scores.append(score)
+
+        # everything that could not be rescored incrementally is scored together in one batch
+        unscored = [i for i, s in enumerate(child_scores) if s is None]
+        if unscored:
+            for i, s in zip(unscored, population_fitness([children[i] for i in unscored], mood, tonic)):
+                child_scores[i] = s
+
+        population = children
+        scores = child_scores
+        fitness = np.array([s.total for s in scores])
+        best = float(fitness.max())
+        stale = 0 if best > history[-1] + MIN_GAIN else stale + 1
+        history.append(max(best, history[-1]))
+        if stale >= patience:
+            break
+
+    order = np.argsort(-fitness, kind='stable')
+    return [population[i] for i in order], fitness[order], history
+
+
+"""
+distinct
+Input: a list of genomes sorted from fittest down, and how many are wanted
+Description: Skips genomes that have the same melody and chord as a fitter one, since a converged
+population is mostly copies. Repeats the fittest ones if there are not enough distinct genomes
+Output: A list with count genomes
+"""
+def distinct(genomes, count):
+    seen = set()
+    picked = []
+    for g in genomes:
+        key = (g.midi.tobytes(), g.spelling.tobytes(), g.durations.tobytes(), g.chord_midi.tobytes())
+        if key not in seen:
+            seen.add(key)
+            picked.append(g)
+        if len(picked) == count:
+            return picked
+    while picked and len(picked) < count:
+        picked.extend(picked[:count - len(picked)])
+    return picked
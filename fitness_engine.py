@@ -0,0 +1,365 @@
+from functools import lru_cache
+import numpy as np
+from pitch_names import NATURAL_STEPS
+
+# The music21 scale class of every mood, by name, so music21 is only loaded once a scale is built (see mood_scale)
+mood_mode_map = {
+    'happy': 'LydianScale',
+    'sad': 'DorianScale',
+    'angry': 'PhrygianScale'
+}
+
+# Intervals that earn a bonus point for each mood, as (generic interval, semitones).
+# M3 is a third spanning 4 semitones, P5 a fifth spanning 7, and so on. The direction does not
+# matter, just like checking for both 'M3' and 'M-3' in fitness_function.
+MOOD_INTERVALS = {
+    'happy': {(3, 4), (5, 7)},   # M3, P5
+    'sad': {(2, 1), (6, 9)},     # m2, M6
+    'angry': {(3, 3), (7, 10)},  # m3, m7
+}
+
+# Batched scoring works on spelled pitches, so D# and E- stay different just like their names do.
+# A spelling is a position on the line of fifths (C = 0, G = 1, F = -1, F# = 6, B- = -2, ...),
+# shifted by SPELLING_OFFSET so quadruple flats through quadruple sharps (all music21 can spell, and the chains
+# do have triple flats) index 0..SPELLINGS-1.
+LETTER_FIFTHS = {'F': -1, 'C': 0, 'G': 1, 'D': 2, 'A': 3, 'E': 4, 'B': 5}
+STEP_SEMITONES = list(NATURAL_STEPS.values()) # semitones above C of each natural letter, by step number (C = 0)
+NATURAL_SEMITONES = np.array(STEP_SEMITONES)
+SPELLING_OFFSET = 29
+SPELLINGS = 63
+REST = -1 # midi value of rests and padding
+
+# INTERVAL_BONUS[mood][generic, semitones] is 1 for the intervals in MOOD_INTERVALS
+MAX_GENERIC = 8
+MAX_SEMITONES = 13
+INTERVAL_BONUS = {}
+for _mood, _intervals in MOOD_INTERVALS.items():
+    INTERVAL_BONUS[_mood] = np.zeros((MAX_GENERIC + 1, MAX_SEMITONES + 1), dtype=np.int64)
+    for _generic, _semitones in _intervals:
+        INTERVAL_BONUS[_mood][_generic, _semitones] = 1
+
+
+"""
+mood_scale
+Input: the mood, and the tonic
+Description: Builds the music21 mode for the mood
+Output: A music21 scale
+"""
+def mood_scale(mood, tonic='C'):
+    from music21 import scale
+    return getattr(scale, mood_mode_map[mood])(tonic)
+
+
+"""
+scale_names
+Input: the mood, and the tonic
+Description: Builds the mode for the mood once per (mood, tonic) and remembers its pitch names
+Output: A frozenset of the pitch names allowed in the mode
+"""
+@lru_cache(maxsize=None)
+def scale_names(mood, tonic='C'):
+    if mood not in mood_mode_map:
+        raise ValueError(f"Unsupported mood: {mood}")
+    return frozenset(p.name for p in mood_scale(mood, tonic).getPitches())
+
+
+"""
+chord_names
+Input: a tuple of pitch names
+Description: Remembers the set of pitch names of every chord it has seen
+Output: A frozenset of the chord's pitch names
+"""
+@lru_cache(maxsize=4096)
+def chord_names(pitch_names):
+    return frozenset(pitch_names)
+
+
+"""
+interval_bonus
+Input: the mood, and the diatonic note number and pitch space value of two notes
+Description: Works out the interval between the notes from their letter distance and semitone
+distance, the same way music21 names it, and looks it up in MOOD_INTERVALS
+Output: 1 if the interval suits the mood, otherwise 0
+"""
+def interval_bonus(mood, dnn1, ps1, dnn2, ps2):
+    if dnn2 >= dnn1:
+        generic, semitones = dnn2 - dnn1 + 1, ps2 - ps1
+    else:
+        generic, semitones = dnn1 - dnn2 + 1, ps1 - ps2
+    return 1 if (generic, semitones) in MOOD_INTERVALS[mood] else 0
+
+
+"""
+fast_fitness_function
+Input: A measure, the mood given, and the tonic
+Description: Same score as reference_operators.fitness_function, but uses the cached scale and scores intervals
+from letter and semitone distances instead of building an interval.Interval for every pair
+Output: The fitness score
+"""
+def fast_fitness_function(measure, mood, tonic='C'):
+    from music21 import note, chord
+    allowed_pitches = scale_names(mood, tonic)
+    elements = list(measure.flatten().notesAndRests)
+
+    score = 0
+    previous = None
+    for element in elements:
+        if isinstance(element, note.Note):
+            p = element.pitch
+            if p.name in allowed_pitches:
+                score += 2
+            if previous is not None:
+                score += interval_bonus(mood, previous.diatonicNoteNum, previous.ps, p.diatonicNoteNum, p.ps)
+            previous = p
+        else:
+            if isinstance(element, chord.Chord):
+                for p in element.pitches:
+                    if p.name in allowed_pitches:
+                        score += 2
+            previous = None
+    return score
+
+
+"""
+fast_general_fitness
+Input: A measure of a melody, and a measure of a harmony chord
+Description: Same score as reference_operators.generalFitnessFunction, with the chord's pitch names worked out once
+Output: The proportion of similar notes to the number of melody notes
+"""
+def fast_general_fitness(melody, harmony):
+    names = chord_names(tuple(p.name for p in harmony.notes[0].pitches))
+    notes = melody.notes
+    fitness = 0
+    for n in notes:
+        if n.pitch.name in names:
+            fitness += 1
+    return fitness / len(notes) * 10
+
+
+"""
+spelling_of
+Input: a music21 pitch
+Description: Finds the pitch's position on the line of fifths. A spelling outside the arrays is refused rather
+than left to wrap around to another one
+Output: The spelling index used by batch_fitness
+"""
+def spelling_of(p):
+    spelling = LETTER_FIFTHS[p.step] + 7 * int(p.alter) + SPELLING_OFFSET
+    if not 0 <= spelling < SPELLINGS:
+        raise ValueError(f"{p.name} has too many accidentals to score")
+    return spelling
+
+
+"""
+scale_mask
+Input: the mood, and the tonic
+Description: Marks the spellings that belong to the mode, once per (mood, tonic)
+Output: A boolean array over all spellings
+"""
+@lru_cache(maxsize=None)
+def scale_mask(mood, tonic='C'):
+    mask = np.zeros(SPELLINGS, dtype=bool)
+    for p in mood_scale(mood, tonic).getPitches():
+        mask[spelling_of(p)] = True
+    return mask
+
+
+"""
+encode_measures
+Input: a list of melody measures, and a list of harmony measures of the same length
+Description: Packs the measures into the padded arrays batch_fitness works on
+Output: midi (P, max_notes) with REST for rests and padding, spelling (P, max_notes), and chord_spellings
+(P, max_chord_notes) with -1 for padding
+"""
+def encode_measures(melodies, harmonies):
+    from music21 import note
+    melody_elements = [list(m.flatten().notesAndRests) for m in melodies]
+    chord_pitches = [h.notes[0].pitches for h in harmonies]
+    width = max([len(e) for e in melody_elements] + [1])
+    chord_width = max([len(c) for c in chord_pitches] + [1])
+
+    midi = np.full((len(melodies), width), REST, dtype=np.int16)
+    spelling = np.zeros((len(melodies), width), dtype=np.int16)
+    chord_spellings = np.full((len(melodies), chord_width), -1, dtype=np.int16)
+    for i, elements in enumerate(melody_elements):
+        for j, element in enumerate(elements):
+            if isinstance(element, note.Note):
+                midi[i, j] = int(element.pitch.ps)
+                spelling[i, j] = spelling_of(element.pitch)
+    for i, pitches in enumerate(chord_pitches):
+        for j, p in enumerate(pitches):
+            chord_spellings[i, j] = spelling_of(p)
+    return midi, spelling, chord_spellings
+
+
+"""
+diatonic_number
+Input: MIDI numbers and spellings (single values or arrays)
+Description: Works out the diatonic note number (music21's diatonicNoteNum) from the letter and the octave
+Output: The diatonic note numbers
+"""
+def diatonic_number(midi, spelling):
+    fifths = np.asarray(spelling, dtype=np.int64) - SPELLING_OFFSET
+    step = (fifths * 4) % 7
+    alter = (fifths + 1) // 7
+    octave = (np.asarray(midi, dtype=np.int64) - alter - NATURAL_SEMITONES[step]) // 12 - 1
+    return octave * 7 + step + 1
+
+
+"""
+note_diatonic_number
+Input: the MIDI number and the spelling of one note
+Description: diatonic_number for a single note, on plain ints (much quicker than NumPy for one value)
+Output: The diatonic note number
+"""
+def note_diatonic_number(midi, spelling):
+    fifths = spelling - SPELLING_OFFSET
+    step = (fifths * 4) % 7
+    alter = (fifths + 1) // 7
+    octave = (midi - alter - STEP_SEMITONES[step]) // 12 - 1
+    return octave * 7 + step + 1
+
+
+"""
+pair_bonus
+Input: the mood, the MIDI numbers of the first and second notes of each pair, and their diatonic note numbers
+Description: Looks every interval up in INTERVAL_BONUS
+Output: 1 for every pair forming one of the mood's intervals, otherwise 0
+"""
+def pair_bonus(mood, midi1, midi2, dnn1, dnn2):
+    steps = dnn2 - dnn1
+    semitones = np.asarray(midi2, dtype=np.int64) - midi1
+    semitones = np.where(steps >= 0, semitones, -semitones)
+    generic = np.abs(steps) + 1
+    known = (generic <= MAX_GENERIC) & (semitones >= 0) & (semitones <= MAX_SEMITONES)
+    return INTERVAL_BONUS[mood][np.where(known, generic, 0), np.where(known, semitones, 0)] * known
+
+
+"""
+fitness_contributions
+Input: a population encoded by encode_measures (midi, spelling and chord_spellings), the mood, and the tonic
+Description: Splits the fitness of every measure into the parts fitness_function adds up: the points of every note,
+the points of every adjacent pair, the points of the chord, and which notes are in the chord
+Output: note points (P, N), pair points (P, N - 1), in chord (P, N), is a note (P, N), chord points (P,),
+and the chord masks (P, SPELLINGS)
+"""
+def fitness_contributions(midi, spelling, chord_spellings, mood, tonic='C'):
+    if mood not in mood_mode_map:
+        raise ValueError(f"Unsupported mood: {mood}")
+    in_scale = scale_mask(mood, tonic)
+    # grace notes have no duration but fitness_function scores them like any other note
+    notes = midi != REST
+    spelling = spelling.astype(np.int64)
+
+    # 2 points for every note of the melody and of the chord in the mode
+    note_points = 2 * (in_scale[spelling] & notes)
+    chord_notes = chord_spellings >= 0
+    chord_points = 2 * (in_scale[np.where(chord_notes, chord_spellings, 0)] & chord_notes).sum(axis=1)
+
+    # 1 point for every adjacent pair of notes forming one of the mood's intervals
+    dnn = diatonic_number(midi, spelling)
+    pairs = notes[:, :-1] & notes[:, 1:]
+    pair_points = pair_bonus(mood, midi[:, :-1], midi[:, 1:], dnn[:, :-1], dnn[:, 1:]) * pairs
+
+    # melody notes whose name is in the chord
+    chord_mask = np.zeros((len(midi), SPELLINGS), dtype=bool)
+    rows = np.nonzero(chord_notes)[0]
+    chord_mask[rows, chord_spellings[chord_notes]] = True
+    in_chord = np.take_along_axis(chord_mask, spelling, axis=1) & notes
+    return note_points, pair_points, in_chord, notes, chord_points, chord_mask
+
+
+"""
+batch_fitness
+Input: a population encoded by encode_measures (midi, spelling and chord_spellings), the mood, and the tonic
+Description: Scores every measure of the population at once with the rules of fitness_function plus
+generalFitnessFunction: 2 points for every melody and chord pitch in the mode, 1 point for every pair of
+adjacent melody notes forming a mood interval, and 10 times the share of melody notes found in the chord
+Output: An array with the fitness of each of the P measures
+"""
+def batch_fitness(midi, spelling, chord_spellings, mood, tonic='C'):
+    note_points, pair_points, in_chord, notes, chord_points, _ = fitness_contributions(midi, spelling, chord_spellings, mood, tonic)
+    score = note_points.sum(axis=1) + chord_points + pair_points.sum(axis=1)
+    note_count = notes.sum(axis=1)
+    general = np.divide(in_chord.sum(axis=1), note_count, out=np.zeros(len(midi)), where=note_count > 0) * 10
+    return score + general
+
+
+"""
+MeasureFitness
+The fitness of one measure kept as running totals, with the pitches it was scored on, so that after a few notes
+change only those notes and the pairs on either side of them are scored again: the old contribution of a note
+is worked out from the old pitches and taken off the totals, the new one added. Nothing is copied per note, so
+an update costs the same however long the measure is. total always equals batch_fitness for the same measure.
+"""
+class MeasureFitness:
+    __slots__ = ('mood', 'tonic', 'midi', 'spelling', 'chord_mask', 'points', 'hits', 'count')
+
+    def __init__(self, mood, tonic, midi, spelling, chord_mask, points, hits, count):
+        self.mood = mood
+        self.tonic = tonic
+        self.midi = midi
+        self.spelling = spelling
+        self.chord_mask = chord_mask
+        self.points = points
+        self.hits = hits
+        self.count = count
+
+    @property
+    def total(self):
+        return self.points + (self.hits / self.count if self.count else 0.0) * 10
+
+    def note_score(self, in_scale, midi, spelling, i):
+        # the points, chord hit and note count of note i
+        m, sp = int(midi[i]), int(spelling[i])
+        if m == REST:
+            return 0, 0, 0
+        return (2 if in_scale[sp] else 0), int(self.chord_mask[sp]), 1
+
+    def pair_score(self, midi, spelling, j):
+        # the interval bonus of notes j and j + 1, with the same rule as interval_bonus, on plain ints
+        m1, m2 = int(midi[j]), int(midi[j + 1])
+        if m1 == REST or m2 == REST:
+            return 0
+        dnn1 = note_diatonic_number(m1, int(spelling[j]))
+        dnn2 = note_diatonic_number(m2, int(spelling[j + 1]))
+        return interval_bonus(self.mood, dnn1, m1, dnn2, m2)
+
+    def updated(self, midi, spelling, changed):
+        # rescores the notes at the changed indices and the pairs on either side of them,
+        # in a new MeasureFitness for the new pitches so this one stays as it was
+        in_scale = scale_mask(self.mood, self.tonic)
+        total, hits, count = self.points, self.hits, self.count
+        last = len(midi) - 1
+        pairs = set()
+        for i in changed:
+            old_points, old_hit, old_note = self.note_score(in_scale, self.midi, self.spelling, i)
+            points, hit, is_note = self.note_score(in_scale, midi, spelling, i)
+            total += points - old_points
+            hits += hit - old_hit
+            count += is_note - old_note
+            if i > 0:
+                pairs.add(i - 1)
+            if i < last:
+                pairs.add(i)
+
+        for j in pairs:
+            total += self.pair_score(midi, spelling, j) - self.pair_score(self.midi, self.spelling, j)
+        # built directly rather than copied, which at a few notes costs as much as the rescoring
+        return MeasureFitness(self.mood, self.tonic, midi, spelling, self.chord_mask, total, hits, count)
+
+
+"""
+measure_fitnesses
+Input: a population encoded by encode_measures, the number of notes in each measure, the mood, and the tonic
+Description: Scores the population in one batch and keeps the totals of every measure, with its pitches
+Output: A list of MeasureFitness, one per measure
+"""
+def measure_fitnesses(midi, spelling, chord_spellings, lengths, mood, tonic='C'):
+    note_points, pair_points, in_chord, notes, chord_points, chord_mask = fitness_contributions(midi, spelling, chord_spellings, mood, tonic)
+    # padding is never a note, so it adds nothing to the sums
+    points = (note_points.sum(axis=1) + pair_points.sum(axis=1) + chord_points).tolist()
+    hits = in_chord.sum(axis=1).tolist()
+    count = notes.sum(axis=1).tolist()
+    return [MeasureFitness(mood, tonic, midi[i, :n], spelling[i, :n], chord_mask[i], points[i], hits[i], count[i])
+            for i, n in enumerate(lengths)]
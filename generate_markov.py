@@ -1,7 +1,9 @@
-from music21 import *
 import sys
 import random
-from ast import literal_eval
+import warnings
+import numpy as np
+from compile_markov import (chain_from_dict, compiled_path, is_up_to_date, load_compiled_chain, load_markov_chain,
+                            source_digest, write_compiled_chain)
 
 # CONFIGURATION
 MEASURES = 8
@@ -12,66 +14,92 @@ MELODY_NOTE_COUNT = MEASURES * NOTES_PER_MEASURE
 CHORD_COUNT = MEASURES
 
 """
-load_markov_chain
-Input: the name of a file
-Description: Converts the file into a dictionary
-Output: A dictionary of dictionaries containing a 2 note Markov chain
-"""
-def load_markov_chain(filename):
-    with open(filename, 'r') as f:
-        lines = f.readlines()
-    chain = {}
-    current_pair = None
-    for line in lines:
-        line = line.strip()
-        if line.endswith('→'):
-            current_pair = literal_eval(line[:-1].strip())
-            chain[current_pair] = {}
-        elif current_pair:
-            chord, prob = line.split(':')
-            chord = chord.strip()
-            prob = float(prob.strip())
-            chain[current_pair][chord] = prob
+load_chain
+Input: the name of a file, and whether it is a chord chain
+Description: Uses the compiled version of the chain when it is up to date (see compile_markov.py). Otherwise
+parses the text file, compiles it and writes the compiled file, so the next process (and every worker) can
+memory map it instead of compiling again; if the file cannot be written it warns and uses the chain in memory.
+A chord chain has to carry the pitches of its chords
+Output: A CompiledChain
+"""
+def load_chain(filename, chords=False):
+    if is_up_to_date(filename):
+        chain = load_compiled_chain(compiled_path(filename))
+        if not chords or chain.chord_indptr is not None:
+            return chain
+    backoff = {}
+    chain = chain_from_dict(load_markov_chain(filename, backoff), backoff, chords)
+    try:
+        write_compiled_chain(chain, compiled_path(filename), source_digest(filename))
+    except OSError as e:
+        warnings.warn(f"could not write {compiled_path(filename)} ({e}), {filename} is compiled again on every import")
     return chain
 
-melody_chain = load_markov_chain('melody_markov_output.txt')
-chord_chain = load_markov_chain('chord_markov_output.txt')
+melody_chain = load_chain('melody_markov_output.txt')
+chord_chain = load_chain('chord_markov_output.txt', chords=True)
+
+
+"""
+start_state
+Input: chain- a compiled Markov chain
+Description: Picks a random context of the chain's highest order to start a sequence from
+Output: A tuple with the token ids of the context's elements
+"""
+def start_state(chain):
+    return tuple(chain.context_ids(int(chain.random_state(random.random()))).tolist())
 
+"""
+next_token
+Input: chain- a compiled Markov chain, history- the token ids of the last elements (only the last chain.order count)
+Description: Draws the next element from the longest context of the history the chain has seen, backing off
+to shorter contexts Katz-style (one lookup per order, down to the empty context, so it never gets stuck)
+Output: The token id of the next element
+"""
+def next_token(chain, history):
+    return chain.next_id(history, random.random())
 
 """
-weighted_choice
-Input: A dictionary containing a note/chord and a corresponding probability
-Description: Picks a note/chord based on the probability
-Output: A random element from the input's keys
+generate_ids
+Input: chain- a compiled Markov chain, count- an integer indicating a number of elements
+Description: create a sequence of elements based on the given Markov chain
+Output: A list of token ids
 """
-def weighted_choice(transitions):
-    rand = random.random()
-    total = 0
-    for choice, prob in transitions.items():
-        total += prob
-        if rand <= total:
-            return choice
-    return random.choice(list(transitions.keys()))
+def generate_ids(chain, count):
+    sequence = list(start_state(chain))
+
+    while len(sequence) < count:
+        sequence.append(next_token(chain, sequence))
+    return sequence[:count]
 
 """
 generate_sequence
-Input: chain-a dictionary of dictionaries containing a 2 note Markov chain, count- an integer indicating a number of elements
+Input: chain- a compiled Markov chain, count- an integer indicating a number of elements
 Description: create a sequence of elements based on the given Markov chain
 Output: A list of elements (notes/chords)
 """
 def generate_sequence(chain, count):
-    state = random.choice(list(chain.keys()))
-    sequence = [state[0], state[1]]
+    return chain.decode(generate_ids(chain, count))
 
-    while len(sequence) < count:
-        key = (sequence[-2], sequence[-1])
-        if key in chain:
-            next_element = weighted_choice(chain[key])
-        else:
-            random_key = random.choice(list(chain.keys()))
-            next_element = random.choice(list(chain[random_key].keys()))
-        sequence.append(next_element)
-    return sequence[:count]
+
+
+"""
+generate_sequences
+Input: chain- a compiled Markov chain, count- the length of every sequence, batch- how many sequences,
+seed- an optional seed for the NumPy random generator
+Description: Generates a whole batch of independent sequences together. Each step looks up the contexts of
+all B histories and draws all B next tokens with a few array operations per order, instead of one Python loop
+per sequence
+Output: A (batch, count) array of token ids, and the table that decodes them (table[ids] gives the names)
+"""
+def generate_sequences(chain, count, batch, seed=None):
+    rng = np.random.default_rng(seed)
+    order = chain.order
+    sequences = np.empty((batch, max(count, order)), dtype=np.int32)
+    sequences[:, :order] = chain.context_ids(chain.random_state(rng.random(batch)))
+    for i in range(order, count):
+        states = chain.context_states(sequences[:, i - order:i])
+        sequences[:, i] = chain.draw(states, rng.random(batch))
+    return sequences[:, :count], chain.tokens
 
 
 
@@ -79,13 +107,13 @@ def generate_sequence(chain, count):
 class instr:
     density: float #probability of dividing
     res: float #shortest note that can be generated
-    pat: stream.Measure # to put the notes in
+    durations: list # quarterLengths of the notes, in the order they are played
 
 
     def __init__(self, density: float, res: float):
         self.density = density
         self.res = res
-        self.pat = stream.Measure(id="")
+        self.durations = []
 
 
 
@@ -93,7 +121,7 @@ class instr:
 divvy
 Input: An instr class
 Description: Given a probability, split a region of beats (for example, 4 beats)
-Output: Void function, but adds a rhythm to a measure
+Output: Void function, but adds the durations of a rhythm to the instr
 """
 def divvy(ip: instr, low, hi):
     # find midpoint
@@ -104,50 +132,58 @@ def divvy(ip: instr, low, hi):
         divvy(ip, low, mid)
         divvy(ip, mid, hi)
     else:
-        ch = note.Note('C', quarterLength=dur)
-        #ch.articulations.append(articulations.Staccato())
-        ip.pat.insert(low,ch)
-
-sampleStream = stream.Stream()
-
+        # the left half is always finished first, so durations stay in time order
+        ip.durations.append(dur)
 
+"""
+rhythm_durations
+Input: the number of measures, and the probability of subdividing a beat
+Description: Runs Stochastic Binary Subdivision on every measure
+Output: A flat list with the quarterLength of every note in the rhythm
+"""
+def rhythm_durations(measures: int, prob: float):
+    durations = []
+    for i in range(measures):
+        sampleMeasure = instr(prob, 0.25)
+        divvy(sampleMeasure, 0.0, 4.0)
+        durations.extend(sampleMeasure.durations)
+    return durations
 
-#newStream.show("text")
+"""
+build_melody_part
+Input: a list of pitch names, and a list of quarterLengths
+Description: Pairs every pitch with the duration at the same position
+Output: A part containing the melody
+"""
+def build_melody_part(pitch_sequence, durations):
+    from music21 import stream, note
+    part = stream.Part()
+    for pitch_name, quarter_length in zip(pitch_sequence, durations):
+        try:
+            n = note.Note(pitch_name)
+            n.quarterLength = quarter_length
+            part.append(n)
+        except:
+            pass # skip invalid notes
+    return part
 
 
 """
 create_composition
-Input: None
+Input: the number of measures, the probability of subdividing a beat, and an optional filepath to export to
 Description: Using Stochastic Binary Subdivision and Markov Chains, generate a melody and harmony
-Output: The function creates a score and writes the music xml file to 'generated_piece.musicxml'
+Output: The score, split into measures. If a filepath is given the music xml is also written there
 """
-def create_composition(measures: int, prob: float):
+def create_composition(measures: int, prob: float, filepath=None):
+    from music21 import stream, tempo, instrument, note, chord
+    from genome import to_pitch
     score = stream.Score()
     score.append(tempo.MetronomeMark(number=TEMPO_BPM))
     melody_sequence = generate_sequence(melody_chain, MELODY_NOTE_COUNT)
-    chord_sequence = generate_sequence(chord_chain, measures)
-    for i in range(measures):
-        sampleMeasure = instr(prob, 0.25)
-        divvy(sampleMeasure, 0.0, 4.0)
-        sampleStream.append(sampleMeasure.pat)
-
-
-
-    num_notes = len(sampleStream.flatten().notes)
-
-
-
-    test_sequence = generate_sequence(melody_chain, num_notes)
-
-    newStream = stream.Part()
-    for i in range(num_notes):
-        try:
-            #print(i)
-            n = note.Note(test_sequence[i])
-            n.quarterLength = sampleStream.flatten().notes[i].quarterLength
-            newStream.append(n)
-        except:
-            pass # skip invalid notes
+    chord_sequence = generate_ids(chord_chain, measures)
+    durations = rhythm_durations(measures, prob)
+    test_sequence = generate_sequence(melody_chain, len(durations))
+    newStream = build_melody_part(test_sequence, durations)
 
     # Melody Part
     melody_part = stream.Part()
@@ -163,25 +199,24 @@ def create_composition(measures: int, prob: float):
     # Chord Part
     chord_part = stream.Part()
     chord_part.insert(0, instrument.Piano())
-    for chord_name in chord_sequence:
-        try:
-            cs = harmony.ChordSymbol(chord_name)
-            ch = chord.Chord(cs.pitches)
-            ch.quarterLength = 4.0
-            chord_part.append(ch)
-        except:
-            pass
-
+    # the chords' pitches were worked out when the chain was compiled
+    for chord_id in chord_sequence:
+        ch = chord.Chord([to_pitch(m, s) for m, s in zip(*chord_chain.chord(chord_id))])
+        ch.quarterLength = 4.0
+        chord_part.append(ch)
+
+    newStream.makeMeasures(inPlace=True)
+    chord_part.makeMeasures(inPlace=True)
     score.append(newStream)
     score.append(chord_part)
 
-    # score.makeMeasures()
-
     # Show music
     #score.show('midi')
     # score.show()
     # score.show('text')
-    score.write('musicxml', 'generated_piece.musicxml')
+    if filepath:
+        score.write('musicxml', filepath)
+    return score
 
 if __name__ == "__main__":
-    create_composition()
+    create_composition(MEASURES, 0.5, 'generated_piece.musicxml')
@@ -0,0 +1,193 @@
+from __future__ import annotations
+from functools import lru_cache
+import random
+import numpy as np
+from fitness_engine import mood_mode_map, mood_scale, spelling_of, REST, SPELLING_OFFSET, NATURAL_SEMITONES
+
+# How music21 spells a pitch it only knows the pitch space value of (note.Note(61.0) is C#, 63.0 is E-, ...):
+# C C# D E- E F F# G G# A B- B as spellings
+PS_SPELLINGS = [fifths + SPELLING_OFFSET for fifths in (0, 7, 2, -3, 4, -1, 6, 1, 8, 3, -2, 5)]
+LETTERS = 'CDEFGAB'
+
+
+"""
+MeasureGenome
+One measure of melody with the chord under it, stored as small NumPy arrays instead of music21 objects.
+Pitches are kept as MIDI numbers plus their spelling on the line of fifths (see fitness_engine), so they
+turn back into exactly the pitch names they came from. The genetic operators below only ever work on these.
+"""
+class MeasureGenome:
+    __slots__ = ('midi', 'spelling', 'durations', 'offsets', 'chord_midi', 'chord_spelling', 'chord_root')
+
+    def __init__(self, midi, spelling, durations, offsets, chord_midi, chord_spelling, chord_root):
+        self.midi = midi
+        self.spelling = spelling
+        self.durations = durations
+        self.offsets = offsets
+        self.chord_midi = chord_midi
+        self.chord_spelling = chord_spelling
+        self.chord_root = chord_root
+
+    def __len__(self):
+        return len(self.midi)
+
+    def with_melody(self, midi, spelling, durations):
+        # a new genome over the same chord; offsets follow from the durations
+        offsets = np.concatenate(([0.0], np.cumsum(durations[:-1]))) if len(durations) else np.zeros(0)
+        return MeasureGenome(midi, spelling, durations, offsets, self.chord_midi, self.chord_spelling, self.chord_root)
+
+    def notes_only(self):
+        # the operators hand back notes only, like list(measure.notes) did
+        keep = self.midi != REST
+        return self.with_melody(self.midi[keep], self.spelling[keep], self.durations[keep])
+
+
+"""
+from_measures
+Input: a measure of the melody, and the measure of the harmony under it
+Description: Copies the pitches, durations and offsets out of the music21 measures
+Output: A MeasureGenome
+"""
+def from_measures(melody: stream.Measure, harmony: stream.Measure):
+    from music21 import note
+    elements = list(melody.notesAndRests)
+    midi = np.full(len(elements), REST, dtype=np.int16)
+    spelling = np.zeros(len(elements), dtype=np.int16)
+    for i, element in enumerate(elements):
+        if isinstance(element, note.Note):
+            midi[i] = int(element.pitch.ps)
+            spelling[i] = spelling_of(element.pitch)
+    durations = np.array([float(e.quarterLength) for e in elements], dtype=np.float64)
+    offsets = np.array([float(e.offset) for e in elements], dtype=np.float64)
+
+    c = harmony.notes[0]
+    chord_midi = np.array([int(p.ps) for p in c.pitches], dtype=np.int16)
+    chord_spelling = np.array([spelling_of(p) for p in c.pitches], dtype=np.int16)
+    return MeasureGenome(midi, spelling, durations, offsets, chord_midi, chord_spelling, int(c.root().ps))
+
+
+"""
+to_pitch
+Input: a MIDI number, and a spelling
+Description: Rebuilds the music21 pitch
+Output: A pitch.Pitch
+"""
+def to_pitch(midi, spelling):
+    from music21 import pitch
+    fifths = int(spelling) - SPELLING_OFFSET
+    step = (fifths * 4) % 7
+    alter = (fifths + 1) // 7
+    octave = (int(midi) - alter - NATURAL_SEMITONES[step]) // 12 - 1
+    accidental = '#' * alter if alter > 0 else '-' * -alter
+    return pitch.Pitch(f"{LETTERS[step]}{accidental}{octave}")
+
+
+"""
+to_notes
+Input: a MeasureGenome
+Description: Renders the melody of the genome as music21 notes and rests
+Output: A list of notes, ready to append to a part
+"""
+def to_notes(genome: MeasureGenome):
+    from music21 import note
+    notes = []
+    for midi, spelling, duration in zip(genome.midi, genome.spelling, genome.durations):
+        if midi == REST:
+            notes.append(note.Rest(quarterLength=float(duration)))
+        else:
+            n = note.Note(to_pitch(midi, spelling))
+            n.quarterLength = float(duration)
+            notes.append(n)
+    return notes
+
+
+"""
+to_chord_measure
+Input: a MeasureGenome
+Description: Renders the chord of the genome as a whole measure chord
+Output: A music21 measure holding the chord
+"""
+def to_chord_measure(genome: MeasureGenome):
+    from music21 import chord, stream
+    c = chord.Chord([to_pitch(m, s) for m, s in zip(genome.chord_midi, genome.chord_spelling)])
+    c.quarterLength = 4.0
+    m = stream.Measure()
+    m.append(c)
+    return m
+
+
+"""
+encode_population
+Input: a list of MeasureGenomes
+Description: Pads the genomes into the arrays fitness_engine.batch_fitness expects
+Output: midi, spelling and chord_spellings arrays, one row per genome
+"""
+def encode_population(genomes):
+    width = max([len(g) for g in genomes] + [1])
+    chord_width = max([len(g.chord_spelling) for g in genomes] + [1])
+    midi = np.full((len(genomes), width), REST, dtype=np.int16)
+    spelling = np.zeros((len(genomes), width), dtype=np.int16)
+    chord_spellings = np.full((len(genomes), chord_width), -1, dtype=np.int16)
+    for i, g in enumerate(genomes):
+        midi[i, :len(g)] = g.midi
+        spelling[i, :len(g)] = g.spelling
+        chord_spellings[i, :len(g.chord_spelling)] = g.chord_spelling
+    return midi, spelling, chord_spellings
+
+
+"""
+scale_pitches
+Input: the mood, and the tonic
+Description: The pitches of the mood's mode (with octaves), worked out once per (mood, tonic)
+Output: A list of (midi, spelling) pairs
+"""
+@lru_cache(maxsize=None)
+def scale_pitches(mood, tonic='C'):
+    if mood not in mood_mode_map:
+        raise ValueError(f"Unsupported mood: {mood}")
+    return [(int(p.ps), spelling_of(p)) for p in mood_scale(mood, tonic).getPitches()]
+
+
+"""
+inversion
+Input: a MeasureGenome
+Description: Taking the root of the chord, invert the melody based off of the distance from the root
+Output: A MeasureGenome with the new melody
+"""
+def inversion(genome: MeasureGenome):
+    g = genome.notes_only()
+    midi = (2 * g.chord_root - g.midi.astype(np.int64) + 12).astype(np.int16)
+    spelling = np.array([PS_SPELLINGS[m % 12] for m in midi], dtype=np.int16)
+    return g.with_melody(midi, spelling, g.durations.copy())
+
+
+"""
+crossover
+Input: Two MeasureGenomes, and a float indicating where we will make the split
+Description: Split the measures at the beat, and then cross them over
+Output: The two children, as MeasureGenomes
+"""
+def crossover(genome1: MeasureGenome, genome2: MeasureGenome, split_beat=2.0):
+    first1, first2 = genome1.offsets < split_beat, genome2.offsets < split_beat
+    def child(a, b, first_a, first_b):
+        pick = lambda field: np.concatenate((getattr(a, field)[first_a], getattr(b, field)[~first_b]))
+        return a.with_melody(pick('midi'), pick('spelling'), pick('durations')).notes_only()
+    return child(genome1, genome2, first1, first2), child(genome2, genome1, first2, first1)
+
+
+"""
+mutate_measure
+Input: a MeasureGenome, mood: 'happy', 'sad', 'angry' (maps to Lydian, Dorian, Phrygian), tonic: tonic root note (default 'C'),
+mutation_rate: probability of mutation per note (0.0 to 1.0)
+Description: Randomly moves notes of the melody onto pitches of the scale for the given mood
+Output: A mutated copy of the genome
+"""
+def mutate_measure(genome: MeasureGenome, mood, tonic='C', mutation_rate=0.3):
+    allowed_pitches = scale_pitches(mood, tonic)
+    g = genome.notes_only()
+    midi = g.midi.copy()
+    spelling = g.spelling.copy()
+    for i in range(len(midi)):
+        if random.random() < mutation_rate:
+            midi[i], spelling[i] = random.choice(allowed_pitches)
+    return g.with_melody(midi, spelling, g.durations.copy())
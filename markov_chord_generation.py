@@ -2,12 +2,15 @@ import sys
 import os
 from music21 import *
 import random
-from collections import defaultdict
+from collections import OrderedDict
+from functools import lru_cache
+import musicxml_tokens
+from compile_markov import compile_markov_chain
+from markov_training import corpus_files, train_corpus, write_chain, TrainingCache, MARKOV_ORDER
 
 folder_path = '/Users/eileenchen/Desktop/jazz-repo'
-
-# Store transitions ((chord1, chord2) -> chord3)
-markov_chain = defaultdict(lambda: defaultdict(int))
+LABEL_CACHE_SIZE = 4096 # most voicings remembered by ChordLabelCache
+STREAMING_EXTRACTION = True # read the chords with musicxml_tokens instead of music21's chordify
 
 def extract_chord_label(chord_obj):
     try:
@@ -19,44 +22,128 @@ def extract_chord_label(chord_obj):
     except Exception:
         return None
 
-for filename in os.listdir(folder_path):
-    if filename.endswith('.xml') or filename.endswith('.mxl'):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            score = converter.parse(file_path)
-
-            chordified = score.chordify()
-            chords = []
-
-            for c in chordified.recurse().getElementsByClass('Chord'):
-                if len(c.pitches) < 2:
-                    continue
-                while len(c.pitches) > 4:
-                    highest = max(c.pitches)
-                    c.remove(highest)
-
-                chord_label = extract_chord_label(c)
-                if chord_label:
-                    chords.append(chord_label)
-
-            # Build second-order transitions
-            for i in range(len(chords) - 2):
-                prev = (chords[i], chords[i+1])
-                next_chord = chords[i+2]
-                if next_chord != "Chord Symbol Cannot Be Identified":
-                    markov_chain[prev][next_chord] += 1
-
-        except Exception as e:
-            print(f"Failed on {filename}: {e}")
-
-output_path = 'chord_markov_output.txt'
-
-with open(output_path, 'w') as f:
-    for prev_pair, transitions in markov_chain.items():
-        total = sum(transitions.values())
-        f.write(f"{prev_pair} →\n")
-        for next_chord, count in transitions.items():
-            if next_chord == "Chord Symbol Cannot Be Identified":
-                continue
-            probability = count / total
-            f.write(f"    {next_chord}: {probability:.2f}\n")
+"""
+ChordLabelCache
+Remembers the figure of the chords it has named, keyed by the bass and the set of pitch names (octaves and doublings
+do not change the figure), so a voicing that comes back is not named again. Holds at most maxsize voicings, dropping
+the least recently used one, and counts its hits and misses. One is shared by every file a process trains on.
+"""
+class ChordLabelCache:
+    def __init__(self, maxsize=LABEL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.labels = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def label(self, voicing, make_chord):
+        # make_chord builds the chord to name, only called on a miss
+        if voicing in self.labels:
+            self.hits += 1
+            self.labels.move_to_end(voicing)
+            return self.labels[voicing]
+        self.misses += 1
+        figure = extract_chord_label(make_chord())
+        self.labels[voicing] = figure
+        if len(self.labels) > self.maxsize:
+            self.labels.popitem(last=False)
+        return figure
+
+label_cache = ChordLabelCache()
+
+"""
+lowest_pitches
+Input: the pitch space values of a chord's pitches, and how many to keep
+Description: Sorts the pitches once and drops the highest ones, the same ones removing max() one at a time would
+(equal pitches go in the order max() finds them)
+Output: The indexes of the pitches kept from low to high, and the indexes of the pitches dropped
+"""
+def lowest_pitches(values, count=4):
+    order = sorted(range(len(values)), key=lambda i: (values[i], -i))
+    return order[:count], order[:count - 1:-1]
+
+"""
+extract_chords
+Input: the path of a MusicXML file
+Description: Chordifies the score, keeps the lowest 4 notes of every chord with at least 2, and names them
+through label_cache
+Output: The list of chord figures in order, and the label cache hits and misses of this file
+"""
+def extract_chords(file_path):
+    hits, misses = label_cache.hits, label_cache.misses
+    score = converter.parse(file_path)
+
+    chordified = score.chordify()
+    chords = []
+
+    for c in chordified.recurse().getElementsByClass('Chord'):
+        if len(c.pitches) < 2:
+            continue
+        pitches = c.pitches
+        kept, dropped = lowest_pitches([p.ps for p in pitches])
+        for i in dropped:
+            c.remove(pitches[i])
+
+        voicing = (pitches[kept[0]].name, frozenset(pitches[i].name for i in kept))
+        chord_label = label_cache.label(voicing, lambda: c)
+        if chord_label:
+            chords.append(chord_label)
+    return chords, {'chord label hits': label_cache.hits - hits, 'chord label misses': label_cache.misses - misses}
+
+"""
+harmony_figure
+Input: the root, the MusicXML kind and the bass (or None) of a <harmony> element
+Description: Names the chord symbol the way music21 does, once per symbol
+Output: The chord figure, or None if music21 cannot make a chord symbol of it
+"""
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def harmony_figure(root, kind, bass):
+    try:
+        return harmony.ChordSymbol(root=root, kind=kind, bass=bass).figure
+    except Exception:
+        return None
+
+"""
+extract_chords_streaming
+Input: the path of a MusicXML file
+Description: Like extract_chords, but reads the file with musicxml_tokens instead of building a music21 score.
+Lead sheets with <harmony> elements give their chord symbols directly; other scores are cut into the same slices
+chordify makes, and the slices are named through label_cache. Scores musicxml_tokens cannot read (timewise ones,
+or any it fails on) go through extract_chords
+Output: The list of chord figures in order, and the label cache hits and misses of this file
+"""
+def extract_chords_streaming(file_path):
+    try:
+        harmonies, slices = musicxml_tokens.chord_material(file_path)
+    except Exception:
+        return extract_chords(file_path)
+    hits, misses = label_cache.hits, label_cache.misses
+    chords = [figure for figure in (harmony_figure(*h) for h in harmonies) if figure]
+
+    for pitches in slices:
+        if len(pitches) < 2:
+            continue
+        kept, _ = lowest_pitches([p[2] for p in pitches])
+        kept = [pitches[i] for i in sorted(kept)]
+        voicing = (min(kept, key=lambda p: p[2])[0], frozenset(p[0] for p in kept))
+        chord_label = label_cache.label(voicing, lambda: chord.Chord([f"{name}{octave}" for name, octave, _ in kept]))
+        if chord_label:
+            chords.append(chord_label)
+    return chords, {'chord label hits': label_cache.hits - hits, 'chord label misses': label_cache.misses - misses}
+
+if __name__ == "__main__":
+    # usage: python markov_chord_generation.py [corpus folder] [workers] [order]
+    folder = sys.argv[1] if len(sys.argv) > 1 else folder_path
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    order = int(sys.argv[3]) if len(sys.argv) > 3 else MARKOV_ORDER
+
+    # Store transitions ((..., chord1, chord2) -> chord3) for every context length up to order, counted per file in worker processes
+    # files parsed before are read back from the cache (see markov_training.TrainingCache)
+    # lead sheets give other tokens with musicxml_tokens, so its sequences are cached apart
+    extract = extract_chords_streaming if STREAMING_EXTRACTION else extract_chords
+    cache = TrainingCache('chords-xml' if STREAMING_EXTRACTION else 'chords')
+    markov_chain, results = train_corpus(corpus_files(folder), extract, workers, cache=cache, order=order)
+    cache.close()
+
+    output_path = 'chord_markov_output.txt'
+    write_chain(markov_chain, output_path)
+    compile_markov_chain(output_path)
@@ -2,12 +2,14 @@ import sys
 import os
 from music21 import *
 import random
-from collections import defaultdict
+import musicxml_tokens
+from compile_markov import compile_markov_chain
+from markov_training import corpus_files, train_corpus, write_chain, TrainingCache, MARKOV_ORDER
 
 folder_path = '/Users/eileenchen/Desktop/jazz-repo'
 
-# Stores transitions like (prev_note -> next_note)
-melody_markov_chain = defaultdict(lambda: defaultdict(int))
+# Stores transitions like (prev_note -> next_note), filled in when the script is run
+melody_markov_chain = {}
 
 def normalize_note(note_obj, key_obj):
     try:
@@ -17,44 +19,59 @@ def normalize_note(note_obj, key_obj):
         return None
 
 
-for filename in os.listdir(folder_path):
-    if filename.endswith('.xml') or filename.endswith('.mxl'):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            score = converter.parse(file_path)
+# normalize_note only looks at the pitch name, so the notes' keys do not have to be worked out
+NORMALIZE_USES_KEY = False
+# read the pitch names straight from the MusicXML (see musicxml_tokens) instead of building a music21 score
+STREAMING_EXTRACTION = True
 
-            # Assuming melody is the highest voice
-            melody_part = score.parts[0] if len(score.parts) > 0 else score
+"""
+extract_melody
+Input: the path of a MusicXML file, and whether normalize_note needs the key of every note
+Description: Takes the first part as the melody and normalizes each of its notes (chords and rests are skipped).
+The key in force is followed while walking the part, and the part is only analyzed for its key once, the first
+time a note has no key of its own
+Output: The list of pitch names, in order
+"""
+def extract_melody(file_path, uses_key=NORMALIZE_USES_KEY):
+    score = converter.parse(file_path)
 
-            # Extracting melody notes
-            melody_notes = []
-            for n in melody_part.flatten().notes:  # Use .flatten() instead of .flat
-                if isinstance(n, note.Note):  # Ignore rests and chords
-                    local_key = n.getContextByClass(key.Key)
-                    if not local_key:
-                        local_key = melody_part.analyze('key')  # fallback to global key
-                    norm_note = normalize_note(n, local_key)
-                    if norm_note:
-                        melody_notes.append(norm_note)
+    # Assuming melody is the highest voice
+    melody_part = score.parts[0] if len(score.parts) > 0 else score
 
-            # Build second-order transitions for melody
-            for i in range(len(melody_notes) - 2):
-                prev = (melody_notes[i], melody_notes[i+1])
-                next_note = melody_notes[i+2]
-                melody_markov_chain[prev][next_note] += 1
+    analyzed_key = [] # the key of the whole part, analyzed at most once
+    def part_key():
+        if not analyzed_key:
+            analyzed_key.append(melody_part.analyze('key'))
+        return analyzed_key[0]
 
-        except Exception as e:
-            print(f"Failed on {filename}: {e}")
+    # Extracting melody notes
+    melody_notes = []
+    current_key = None
+    for n in melody_part.flatten():  # Use .flatten() instead of .flat
+        if isinstance(n, key.Key):
+            current_key = n
+        elif isinstance(n, note.Note):  # Ignore rests and chords
+            local_key = None
+            if uses_key:
+                local_key = current_key if current_key else part_key()  # fallback to global key
+            norm_note = normalize_note(n, local_key)
+            if norm_note:
+                melody_notes.append(norm_note)
+    return melody_notes
 
-output_path = 'melody_markov_output.txt'
-
-with open(output_path, 'w') as f:
-    for prev_pair, transitions in melody_markov_chain.items():
-        total = sum(transitions.values())
-        f.write(f"{prev_pair} →\n")
-        for next_note, count in transitions.items():
-            probability = count / total
-            f.write(f"    {next_note}: {probability:.2f}\n")
+"""
+extract_melody_streaming
+Input: the path of a MusicXML file
+Description: Gives the same pitch names as extract_melody without the keys, read with musicxml_tokens instead of
+building a music21 score. Scores musicxml_tokens cannot read (timewise ones, or any it fails on) go through
+extract_melody
+Output: The list of pitch names, in order
+"""
+def extract_melody_streaming(file_path):
+    try:
+        return musicxml_tokens.melody_pitches(file_path)
+    except Exception:
+        return extract_melody(file_path)
 
 
 # Function to generate a melody based on the Markov chain
@@ -75,3 +92,21 @@ def generate_melody(start_note, num_notes=20):
                 melody.append(next_note)
                 break
     return melody
+
+
+if __name__ == "__main__":
+    # usage: python markov_melody_generation.py [corpus folder] [workers] [order]
+    folder = sys.argv[1] if len(sys.argv) > 1 else folder_path
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    order = int(sys.argv[3]) if len(sys.argv) > 3 else MARKOV_ORDER
+
+    # Transitions for every context length up to order, counted per file in worker processes, then merged
+    # files parsed before are read back from the cache (see markov_training.TrainingCache)
+    extract = extract_melody_streaming if STREAMING_EXTRACTION and not NORMALIZE_USES_KEY else extract_melody
+    cache = TrainingCache('melody')
+    melody_markov_chain, results = train_corpus(corpus_files(folder), extract, workers, cache=cache, order=order)
+    cache.close()
+
+    output_path = 'melody_markov_output.txt'
+    write_chain(melody_markov_chain, output_path)
+    compile_markov_chain(output_path)
@@ -0,0 +1,267 @@
+import os
+import time
+import json
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from compile_markov import source_digest
+
+CORPUS_EXTENSIONS = ('.xml', '.mxl')
+CACHE_FILE = 'training_cache.sqlite'
+MARKOV_ORDER = 2 # longest context counted; generation backs off from it down to no context at all
+MIN_CONTEXT_COUNT = 2 # contexts longer than 2 seen fewer times than this are left out of the chain
+KATZ_MAX_COUNT = 5 # transitions seen more often than this are not discounted
+
+
+"""
+FileResult
+What training on one file produced: its token sequence, its transition counts for every order, how many tokens it had,
+how long it took, the error if it failed (sequence and counts are then empty), whether it came from the cache,
+and any counters the extractor reported (such as cache hits)
+"""
+class FileResult:
+    __slots__ = ('filename', 'sequence', 'counts', 'tokens', 'seconds', 'error', 'cached', 'stats')
+
+    def __init__(self, filename, sequence, counts, seconds, error=None, cached=False, stats=None):
+        self.filename = filename
+        self.sequence = sequence
+        self.counts = counts
+        self.tokens = len(sequence)
+        self.seconds = seconds
+        self.error = error
+        self.cached = cached
+        self.stats = stats or {}
+
+
+"""
+TrainingCache
+The token sequence extracted from every file, stored in a SQLite file and keyed by what was extracted (kind, such as
+'chords' or 'melody') and the SHA-1 of the file's bytes. A file that is renamed or moved is still found; a file that
+changed gets a new hash and is parsed again. Delete the cache file after changing how tokens are extracted.
+"""
+class TrainingCache:
+    def __init__(self, kind, filename=CACHE_FILE):
+        self.kind = kind
+        self.db = sqlite3.connect(filename)
+        self.db.execute("CREATE TABLE IF NOT EXISTS sequences (kind TEXT, digest TEXT, tokens TEXT, PRIMARY KEY (kind, digest))")
+
+    def get(self, digest):
+        row = self.db.execute("SELECT tokens FROM sequences WHERE kind = ? AND digest = ?", (self.kind, digest)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, digest, sequence):
+        self.db.execute("INSERT OR REPLACE INTO sequences VALUES (?, ?, ?)", (self.kind, digest, json.dumps(sequence)))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+"""
+corpus_files
+Input: the path of the corpus folder
+Description: Finds the MusicXML files in the folder, in a stable order
+Output: A sorted list of file paths
+"""
+def corpus_files(folder_path):
+    return [os.path.join(folder_path, filename) for filename in sorted(os.listdir(folder_path))
+            if filename.endswith(CORPUS_EXTENSIONS)]
+
+
+"""
+count_transitions
+Input: a list of tokens (pitch names, chord figures, ...), and the longest context to count
+Description: Counts every transition from the tokens before it to the next token, for contexts of 0 up to order
+tokens: () -> token3, (token2,) -> token3, (token1, token2) -> token3, ...
+Output: A dict from context tuples to a dict from the next token to its count
+"""
+def count_transitions(tokens, order=MARKOV_ORDER):
+    counts = {}
+    for i, token in enumerate(tokens):
+        for k in range(min(order, i) + 1):
+            following = counts.setdefault(tuple(tokens[i - k:i]), {})
+            following[token] = following.get(token, 0) + 1
+    return counts
+
+
+"""
+merge_counts
+Input: the merged transition counts so far, and the counts of one more file
+Description: Adds the counts of the file into the merged counts
+Output: None, total is changed in place
+"""
+def merge_counts(total, counts):
+    for state, following in counts.items():
+        merged = total.setdefault(state, {})
+        for token, count in following.items():
+            merged[token] = merged.get(token, 0) + count
+
+
+"""
+train_file
+Input: the function that turns a file into its list of tokens (or into the list and a dict of counters),
+the path of the file, and the longest context to count
+Description: Extracts the tokens of one file and counts their transitions. Any error is caught and
+returned, so one bad file does not stop the others
+Output: A FileResult
+"""
+def train_file(extract, file_path, order=MARKOV_ORDER):
+    start = time.perf_counter()
+    filename = os.path.basename(file_path)
+    try:
+        tokens = extract(file_path)
+        stats = None
+        if isinstance(tokens, tuple):
+            tokens, stats = tokens
+        return FileResult(filename, tokens, count_transitions(tokens, order), time.perf_counter() - start, stats=stats)
+    except Exception as e:
+        return FileResult(filename, [], {}, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+
+
+"""
+train_corpus
+Input: a list of file paths, the function that turns a file into its list of tokens (it has to be defined at the
+top level of a module so worker processes can use it), the number of worker processes, whether to print progress,
+an optional TrainingCache, and the longest context to count
+Description: Takes the tokens of every file already in the cache from there, parses the rest in a process pool
+(or one by one when workers is 1) and adds them to the cache, printing every file as it finishes with its time,
+and merges the counts of all files. The counts are merged in file order, so the result does not
+depend on which worker finished first. The counters the extractor reported are added up and printed at the end
+Output: The merged transition counts, and the FileResult of every file in file order
+"""
+def train_corpus(files, extract, workers=None, progress=True, cache=None, order=MARKOV_ORDER):
+    results = [None] * len(files)
+    start = time.perf_counter()
+    done = 0
+
+    def report(result):
+        nonlocal done
+        done += 1
+        if not progress:
+            return
+        if result.error:
+            print(f"[{done}/{len(files)}] Failed on {result.filename}: {result.error}")
+        elif result.cached:
+            print(f"[{done}/{len(files)}] {result.filename}: {result.tokens} tokens (cached)")
+        else:
+            print(f"[{done}/{len(files)}] {result.filename}: {result.tokens} tokens in {result.seconds:.2f} s")
+
+    digests = [source_digest(file_path) for file_path in files] if cache else [None] * len(files)
+    todo = []
+    for i, file_path in enumerate(files):
+        sequence = cache.get(digests[i]) if cache else None
+        if sequence is None:
+            todo.append(i)
+        else:
+            results[i] = FileResult(os.path.basename(file_path), sequence, count_transitions(sequence, order), 0.0, cached=True)
+            report(results[i])
+
+    if workers == 1 or len(todo) <= 1:
+        for i in todo:
+            results[i] = train_file(extract, files[i], order)
+            report(results[i])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(train_file, extract, files[i], order): i for i in todo}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                report(results[futures[future]])
+
+    if cache:
+        for i in todo:
+            if not results[i].error:
+                cache.put(digests[i], results[i].sequence)
+
+    total = {}
+    for result in results:
+        merge_counts(total, result.counts)
+    if progress:
+        failed = sum(1 for r in results if r.error)
+        print(f"{len(files) - failed} files trained ({len(files) - len(todo)} from the cache), {failed} failed, "
+              f"in {time.perf_counter() - start:.1f} s")
+        stats = {}
+        for result in results:
+            for name, value in result.stats.items():
+                stats[name] = stats.get(name, 0) + value
+        if stats:
+            print(", ".join(f"{value} {name}" for name, value in stats.items()))
+    return total, results
+
+
+"""
+katz_discounts
+Input: the merged transition counts
+Description: Works out the Good-Turing discount of Katz backoff for every order: a transition seen r times
+(r up to KATZ_MAX_COUNT) keeps d_r of its count, and what is taken away is left for the shorter contexts.
+When there are too few transitions for the estimate to make sense (d_r outside (0, 1]), half a count is
+taken away instead. The empty context is never discounted
+Output: A dict from order to a dict from count to its discount
+"""
+def katz_discounts(counts):
+    seen = {} # order -> count -> how many transitions were seen that often
+    for context, following in counts.items():
+        n = seen.setdefault(len(context), {})
+        for count in following.values():
+            n[count] = n.get(count, 0) + 1
+    discounts = {}
+    for order, n in seen.items():
+        discounts[order] = {}
+        if order == 0:
+            continue
+        top = (KATZ_MAX_COUNT + 1) * n.get(KATZ_MAX_COUNT + 1, 0) / n[1] if n.get(1) else 0
+        for r in range(1, KATZ_MAX_COUNT + 1):
+            d = ((r + 1) * n.get(r + 1, 0) / (r * n[r]) - top) / (1 - top) if n.get(r) and top < 1 else 0
+            discounts[order][r] = d if 0 < d <= 1 else (r - 0.5) / r
+    return discounts
+
+
+"""
+katz_chain
+Input: the merged transition counts
+Description: Turns the counts into a Katz backoff chain. Every context keeps its discounted counts, and the
+probability that was discounted away is the chance of backing off to the context one token shorter, which only
+hands it to the tokens this context never saw (see compile_markov.CompiledChain). A context whose shorter context
+gives no probability to any other token has nothing to back off to, so it is not discounted.
+Contexts longer than 2 tokens seen fewer than MIN_CONTEXT_COUNT times are dropped; generation backs off
+past them, which keeps the chain from growing with every rare long context
+Output: A dict from context to (dict from next token to its probability among the seen ones, backoff probability)
+"""
+def katz_chain(counts):
+    discounts = katz_discounts(counts)
+    chain = {}
+    for context in sorted(counts, key=len):
+        following = counts[context]
+        total = sum(following.values())
+        if len(context) > 2 and total < MIN_CONTEXT_COUNT:
+            continue
+        d = discounts[len(context)]
+        if context:
+            # what the shorter context leaves for the tokens this one never saw, the denominator of Katz's alpha
+            # (a dropped context is skipped over, like generation does)
+            shorter = context[1:]
+            while shorter not in chain:
+                shorter = shorter[1:]
+            shorter, shorter_backoff = chain[shorter]
+            if 1 - (1 - shorter_backoff) * sum(shorter.get(token, 0) for token in following) < 1e-9:
+                d = {}
+        kept = {token: count * d.get(count, 1) for token, count in following.items()}
+        mass = sum(kept.values())
+        chain[context] = ({token: count / mass for token, count in kept.items()}, 1 - mass / total)
+    return chain
+
+
+"""
+write_chain
+Input: the merged transition counts, and the path of the text file to write
+Description: Writes the Katz backoff chain (see katz_chain) in the format compile_markov.load_markov_chain reads:
+every context with its backoff probability after the arrow, then the probability of every next token among the
+ones seen after it. Shorter contexts come first
+Output: None
+"""
+def write_chain(counts, output_path):
+    chain = katz_chain(counts)
+    with open(output_path, 'w') as f:
+        for context in sorted(chain, key=len):
+            transitions, backoff = chain[context]
+            f.write(f"{context} → {backoff:.4f}\n")
+            for next_token, probability in transitions.items():
+                f.write(f"    {next_token}: {probability:.4f}\n")
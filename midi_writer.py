@@ -0,0 +1,252 @@
+import struct
+
+# Same resolution music21 writes, so files from either path line up tick for tick
+TICKS_PER_QUARTER = 10080
+DRUM_CHANNEL = 9 # channel 10, zero indexed
+
+
+"""
+varlen
+Input: a non negative integer
+Description: Encodes the integer as a MIDI variable length quantity (7 bits per byte, high bit set on all but the last)
+Output: The encoded bytes
+"""
+def varlen(value):
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(out))
+
+
+"""
+note_on
+Input: the channel, the note, and the velocity
+Description: Builds a note on message
+Output: The message bytes
+"""
+def note_on(channel, note, velocity):
+    return bytes((0x90 | channel, note, velocity))
+
+"""
+note_off
+Input: the channel, the note, and the release velocity
+Description: Builds a note off message
+Output: The message bytes
+"""
+def note_off(channel, note, velocity=0):
+    return bytes((0x80 | channel, note, velocity))
+
+"""
+program_change
+Input: the channel, and the program (instrument) number
+Description: Builds a program change message
+Output: The message bytes
+"""
+def program_change(channel, program):
+    return bytes((0xC0 | channel, program))
+
+
+"""
+tempo_event
+Input: the tempo in beats per minute
+Description: Builds the set tempo meta event (microseconds per quarter note)
+Output: The meta event bytes, without a delta time
+"""
+def tempo_event(bpm):
+    return b'\xff\x51\x03' + (round(60000000 / bpm)).to_bytes(3, 'big')
+
+
+END_OF_TRACK = b'\xff\x2f\x00'
+
+
+"""
+header_chunk
+Input: the SMF format, the number of tracks, and the ticks per quarter note
+Description: Builds the MThd chunk
+Output: The chunk bytes
+"""
+def header_chunk(midi_format, tracks, division=TICKS_PER_QUARTER):
+    return b'MThd' + struct.pack('>IHHH', 6, midi_format, tracks, division)
+
+
+"""
+MidiFileSink
+Writes a single track standard MIDI file while events arrive. The track length is not known until the end,
+so a placeholder is written and patched when the sink is closed.
+Events are placed by their beat (quarter note) position, so the file is exact whatever the real time was.
+"""
+class MidiFileSink:
+    def __init__(self, filename, bpm):
+        self.file = open(filename, 'wb')
+        self.file.write(header_chunk(0, 1))
+        self.file.write(b'MTrk')
+        self.length_at = self.file.tell()
+        self.file.write(b'\0\0\0\0')
+        self.track_bytes = 0
+        self.last_tick = 0
+        self.write(0, tempo_event(bpm))
+
+    def write(self, tick, event):
+        data = varlen(max(tick - self.last_tick, 0)) + event
+        self.last_tick = max(tick, self.last_tick)
+        self.file.write(data)
+        self.track_bytes += len(data)
+
+    def send(self, beat, message):
+        self.write(round(beat * TICKS_PER_QUARTER), message)
+
+    def close(self):
+        self.write(self.last_tick, END_OF_TRACK)
+        self.file.seek(self.length_at)
+        self.file.write(self.track_bytes.to_bytes(4, 'big'))
+        self.file.close()
+
+
+"""
+MidiPortSink
+Sends events straight to a MIDI output port, creating a virtual port by default. Needs the optional mido
+package (and a backend such as python-rtmidi), which is only imported when a port sink is made.
+"""
+class MidiPortSink:
+    def __init__(self, name='Emotional Jazz', virtual=True):
+        try:
+            import mido
+        except ImportError:
+            raise ImportError("Sending to a MIDI port needs mido: pip install mido python-rtmidi")
+        self.mido = mido
+        self.port = mido.open_output(name, virtual=virtual)
+
+    def send(self, beat, message):
+        self.port.send(self.mido.Message.from_bytes(message))
+
+    def close(self):
+        self.port.reset()
+        self.port.close()
+
+
+"""
+NoteTrack
+The notes of one instrument as parallel arrays: onsets and durations in beats, MIDI pitches and velocities
+"""
+class NoteTrack:
+    __slots__ = ('channel', 'program', 'onsets', 'durations', 'pitches', 'velocities')
+
+    def __init__(self, channel, program, onsets, durations, pitches, velocities):
+        self.channel = channel
+        self.program = program
+        self.onsets = onsets
+        self.durations = durations
+        self.pitches = pitches
+        self.velocities = velocities
+
+
+"""
+track_chunk
+Input: a list of (tick, order, event bytes) tuples
+Description: Sorts the events (note offs sort before note ons on the same tick) and writes them as an MTrk chunk
+Output: The chunk bytes
+"""
+def track_chunk(events):
+    events.sort(key=lambda e: (e[0], e[1]))
+    data = bytearray()
+    last = 0
+    for tick, _, event in events:
+        data += varlen(tick - last)
+        data += event
+        last = tick
+    data += varlen(0) + END_OF_TRACK
+    return b'MTrk' + len(data).to_bytes(4, 'big') + bytes(data)
+
+
+"""
+note_track_chunk
+Input: a NoteTrack
+Description: Turns every note into a note on and a note off at the right ticks
+Output: The MTrk chunk bytes
+"""
+def note_track_chunk(track):
+    events = []
+    if track.program is not None:
+        events.append((0, -2, program_change(track.channel, track.program)))
+    for onset, duration, midi, velocity in zip(track.onsets, track.durations, track.pitches, track.velocities):
+        start = round(onset * TICKS_PER_QUARTER)
+        end = round((onset + duration) * TICKS_PER_QUARTER)
+        events.append((start, 0, note_on(track.channel, int(midi), int(velocity))))
+        events.append((end, -1, note_off(track.channel, int(midi))))
+    return track_chunk(events)
+
+
+"""
+midi_bytes
+Input: a list of NoteTracks, and the tempo in beats per minute
+Description: Builds a format 1 standard MIDI file: a tempo track followed by one track per NoteTrack
+Output: The bytes of the file
+"""
+def midi_bytes(tracks, bpm=120):
+    chunks = [header_chunk(1, len(tracks) + 1), track_chunk([(0, 0, tempo_event(bpm))])]
+    chunks.extend(note_track_chunk(t) for t in tracks)
+    return b''.join(chunks)
+
+
+"""
+write_midi_file
+Input: the filename, a list of NoteTracks, and the tempo in beats per minute
+Description: Writes the tracks straight to a MIDI file, without building music21 streams
+Output: None
+"""
+def write_midi_file(filename, tracks, bpm=120):
+    with open(filename, 'wb') as f:
+        f.write(midi_bytes(tracks, bpm))
+
+
+"""
+drum_track
+Input: a list of drum symbols (see drums.PERC_MAP), whether to swing, optional velocities per symbol,
+and optional offsets in beats added to every onset (micro timing)
+Description: Lays the symbols out like drums.sequence_to_stream does (0.67/0.33 swung eighths, or straight 0.5)
+Output: A NoteTrack on the drum channel
+"""
+def drum_track(seq, swing=True, velocities=None, offsets=None):
+    from drums import PERC_MAP
+    onsets, durations, pitches, vels = [], [], [], []
+    time = 0.0
+    for i, symbol in enumerate(seq):
+        dur = (0.67 if i % 2 == 0 else 0.33) if swing else 0.5
+        if PERC_MAP[symbol] is not None:
+            onsets.append(time + (offsets[i] if offsets is not None else 0.0))
+            durations.append(dur)
+            pitches.append(PERC_MAP[symbol])
+            vels.append(velocities[i] if velocities is not None else 75)
+        time += dur
+    return NoteTrack(DRUM_CHANNEL, None, onsets, durations, pitches, vels)
+
+
+"""
+genome_tracks
+Input: the melody genomes and the chord genomes in playing order, the melody program, and the velocity (90 is what music21 writes for notes without one)
+Description: Lays out the melodies back to back and one whole measure chord per chord genome, like render_piece does
+Output: The melody NoteTrack and the chord NoteTrack
+"""
+def genome_tracks(melody_genomes, chord_genomes, program=0, velocity=90):
+    from genome import REST
+    melody = NoteTrack(0, program, [], [], [], [])
+    time = 0.0
+    for g in melody_genomes:
+        for midi, duration in zip(g.midi, g.durations):
+            if midi != REST:
+                melody.onsets.append(time)
+                melody.durations.append(float(duration))
+                melody.pitches.append(int(midi))
+                melody.velocities.append(velocity)
+            time += float(duration)
+
+    chords = NoteTrack(1, 0, [], [], [], [])
+    for i, g in enumerate(chord_genomes):
+        for midi in g.chord_midi:
+            chords.onsets.append(i * 4.0)
+            chords.durations.append(4.0)
+            chords.pitches.append(int(midi))
+            chords.velocities.append(velocity)
+    return melody, chords
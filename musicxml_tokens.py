@@ -0,0 +1,281 @@
+import zipfile
+import posixpath
+from fractions import Fraction
+from xml.etree.ElementTree import iterparse
+from pitch_names import NATURAL_STEPS
+
+STEPS = 'CDEFGAB'
+
+
+"""
+open_musicxml
+Input: the path of a .xml, .musicxml or compressed .mxl file
+Description: Opens the score for reading. For .mxl files the score is found through META-INF/container.xml
+and read straight out of the zip, without unpacking it
+Output: A binary file object
+"""
+def open_musicxml(file_path):
+    if not file_path.endswith('.mxl'):
+        return open(file_path, 'rb')
+    archive = zipfile.ZipFile(file_path)
+    names = archive.namelist()
+    root = None
+    if 'META-INF/container.xml' in names:
+        for _, element in iterparse(archive.open('META-INF/container.xml')):
+            if element.tag.endswith('rootfile') and element.get('full-path'):
+                root = element.get('full-path')
+                break
+    if root is None:
+        root = next(n for n in names if n.endswith(('.xml', '.musicxml')) and not n.startswith('META-INF'))
+    return archive.open(posixpath.normpath(root))
+
+
+"""
+ScoreEvent
+A note, chord member or rest of one part: which measure of the part it is in, where it starts and ends in quarter
+notes from the start of that measure, its pitch name, octave and MIDI number (None for rests and unpitched notes),
+its staff, whether it is a grace note or part of a chord, the part's <transpose> as (diatonic, chromatic) steps
+(None if it does not transpose), and its position in the file
+"""
+class ScoreEvent:
+    __slots__ = ('part', 'measure', 'onset', 'end', 'name', 'octave', 'ps', 'staff', 'grace', 'chord', 'transpose', 'order')
+
+    def __init__(self, part, measure, onset, end, name, octave, ps, staff, grace, chord, transpose, order):
+        self.part = part
+        self.measure = measure
+        self.onset = onset
+        self.end = end
+        self.name = name
+        self.octave = octave
+        self.ps = ps
+        self.staff = staff
+        self.grace = grace
+        self.chord = chord
+        self.transpose = transpose
+        self.order = order
+
+
+"""
+alter_value
+Input: the text of an <alter> element
+Description: Reads the alteration, keeping whole steps as ints so pitch numbers stay ints like music21's
+Output: The alteration in semitones
+"""
+def alter_value(text):
+    alter = float(text)
+    return int(alter) if alter == int(alter) else alter
+
+
+"""
+alter_name
+Input: an alteration in semitones
+Description: Spells the accidental the way music21 writes it in a pitch name: one '#' or '-' per whole semitone
+(so triple flats and sharps too), then '~' or '`' for a quarter tone up or down
+Output: The accidental string ('' for a natural)
+"""
+def alter_name(alter):
+    whole = int(alter)
+    name = '#' * whole if whole > 0 else '-' * -whole
+    if alter != whole:
+        name += '~' if alter > 0 else '`'
+    return name
+
+
+"""
+read_events
+Input: the path of a MusicXML file
+Description: Streams through a partwise score with an incremental XML parser, working out where every note starts
+from its <duration>, <backup>, <forward> and <chord/> elements. Every element is cleared once it is read, so memory
+does not grow with the file. A note is only known to start a chord when the next one has <chord/>, so every
+note is yielded one note late
+Output: Yields ('note', ScoreEvent) for every note and rest, ('harmony', (root, kind, bass)) for every <harmony>
+element, and ('measure', part index, measure index) at the end of every measure
+"""
+def read_events(file_path):
+    with open_musicxml(file_path) as f:
+        part = -1
+        measure = 0
+        divisions = Fraction(1)
+        transpose = None
+        position = Fraction(0)
+        last_onset = Fraction(0)
+        pending = None
+        order = 0
+        for event, element in iterparse(f, events=('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                if tag == 'part':
+                    part += 1
+                    measure = 0
+                    divisions = Fraction(1)
+                    transpose = None
+                elif tag == 'score-timewise':
+                    raise ValueError("timewise MusicXML is not supported")
+                continue
+
+            if tag == 'divisions':
+                divisions = Fraction(element.text.strip())
+            elif tag == 'transpose':
+                octaves = int(element.findtext('octave-change', '0'))
+                transpose = (int(element.findtext('diatonic', '0')) + 7 * octaves,
+                             int(element.findtext('chromatic', '0')) + 12 * octaves)
+                element.clear()
+            elif tag == 'note':
+                duration = element.find('duration')
+                length = Fraction(duration.text.strip()) / divisions if duration is not None else Fraction(0)
+                in_chord = element.find('chord') is not None
+                onset = last_onset if in_chord else position
+                pitch = element.find('pitch')
+                name = octave = ps = None
+                if pitch is not None:
+                    alter = alter_value(pitch.findtext('alter', '0'))
+                    step = pitch.findtext('step').strip()
+                    octave = int(pitch.findtext('octave'))
+                    name = step + alter_name(alter)
+                    ps = NATURAL_STEPS[step] + alter + 12 * (octave + 1)
+                if in_chord and pending is not None:
+                    pending.chord = True
+                if pending is not None:
+                    yield 'note', pending
+                pending = ScoreEvent(part, measure, onset, onset + length, name, octave, ps,
+                                     int(element.findtext('staff', '1')), element.find('grace') is not None,
+                                     in_chord, transpose, order)
+                order += 1
+                if not in_chord:
+                    last_onset = onset
+                    position += length
+                element.clear()
+            elif tag == 'backup':
+                position -= Fraction(element.findtext('duration').strip()) / divisions
+                element.clear()
+            elif tag == 'forward':
+                position += Fraction(element.findtext('duration').strip()) / divisions
+                element.clear()
+            elif tag == 'harmony':
+                root = element.find('root')
+                kind = element.findtext('kind', '').strip()
+                if root is not None and kind and kind != 'none':
+                    bass = element.find('bass')
+                    yield 'harmony', (spelled(root, 'root'), kind, spelled(bass, 'bass') if bass is not None else None)
+                element.clear()
+            elif tag == 'measure':
+                if pending is not None:
+                    yield 'note', pending
+                    pending = None
+                yield 'measure', part, measure
+                measure += 1
+                position = Fraction(0)
+                element.clear()
+        if pending is not None:
+            yield 'note', pending
+
+
+"""
+spelled
+Input: a <root> or <bass> element, and its prefix
+Description: Reads the step and alter of a harmony's root or bass
+Output: The pitch name, like 'B-'
+"""
+def spelled(element, prefix):
+    return element.findtext(prefix + '-step').strip() + alter_name(alter_value(element.findtext(prefix + '-alter', '0')))
+
+
+"""
+sounding
+Input: a pitched ScoreEvent
+Description: Moves the written pitch of a transposing instrument to the pitch that sounds, spelled the way the
+interval spells it (like music21's toSoundingPitch)
+Output: The (name, octave, ps) that sounds
+"""
+def sounding(e):
+    if not e.transpose:
+        return e.name, e.octave, e.ps
+    diatonic, chromatic = e.transpose
+    steps = STEPS.index(e.name[0]) + diatonic
+    step = STEPS[steps % 7]
+    octave = e.octave + steps // 7
+    ps = e.ps + chromatic
+    alter = ps - (NATURAL_STEPS[step] + 12 * (octave + 1))
+    return step + alter_name(alter), octave, ps
+
+
+"""
+melody_pitches
+Input: the path of a MusicXML file
+Description: The pitch names of the notes of the first part's first staff, skipping rests, unpitched notes and
+chords, in the order music21's flatten() puts them (by offset, grace notes first). Only one measure is held at a time
+Output: The list of pitch names
+"""
+def melody_pitches(file_path):
+    names = []
+    measure = []
+    for item in read_events(file_path):
+        if item[0] == 'note':
+            e = item[1]
+            if e.part == 0 and e.staff == 1 and e.name is not None and not e.chord:
+                measure.append(e)
+        elif item[0] == 'measure':
+            if item[1] > 0:
+                break
+            measure.sort(key=lambda e: (e.onset, not e.grace, e.order))
+            names.extend(e.name for e in measure)
+            measure = []
+    return names
+
+
+"""
+chord_material
+Input: the path of a MusicXML file
+Description: Reads what chords can be made of: the <harmony> symbols of a lead sheet (a score whose notes never
+sound two pitches at once), and otherwise the slices chordify would make. Like chordify, the n-th measure of every
+part is sliced together (so the measures line up even when one part has a short measure), at every time a note or
+rest starts or ends; a slice holds the pitches of the notes that start at or hold over its start (grace notes
+included), without repeated pitches, from low to high. Like chordify, the pitches are moved to the pitch that sounds
+only when the first part is for a transposing instrument, which is known once the first part's first measure is read.
+Parts come one after another in the file, so every measure is kept until the end, but only as compact
+(onset, end, name, octave, ps) tuples (name, octave and ps are None for rests)
+Output: A list of (root, kind, bass) harmony symbols, and a list of slices, each a list of (name, octave, ps)
+"""
+def chord_material(file_path):
+    harmonies = []
+    measures = {} # measure index -> list of (onset, end, name, octave, ps) from every part
+    first = [] # the ScoreEvents of the first part's first measure, until to_sounding is known
+    to_sounding = None
+
+    def keep(e):
+        p = sounding(e) if to_sounding and e.name is not None else (e.name, e.octave, e.ps)
+        measures.setdefault(e.measure, []).append((e.onset, e.end) + p)
+
+    for item in read_events(file_path):
+        if item[0] == 'harmony':
+            harmonies.append(item[1])
+        elif item[0] == 'note':
+            if to_sounding is None:
+                first.append(item[1])
+            else:
+                keep(item[1])
+        elif to_sounding is None and item[1:] == (0, 0):
+            to_sounding = any(e.transpose for e in first)
+            for e in first:
+                keep(e)
+            first = []
+
+    slices = []
+    for index in sorted(measures):
+        events = measures[index]
+        times = sorted({Fraction(0)} | {e[0] for e in events} | {e[1] for e in events})
+        pitched = [e for e in events if e[2] is not None]
+        for start, end in zip(times, times[1:]):
+            seen = set()
+            pitches = []
+            for onset, stop, name, octave, ps in pitched:
+                if onset == start or onset < start < stop:
+                    if (name, octave) not in seen:
+                        seen.add((name, octave))
+                        pitches.append((name, octave, ps))
+            if pitches:
+                pitches.sort(key=lambda p: p[2])
+                slices.append(pitches)
+    if harmonies and all(len(pitches) < 2 for pitches in slices):
+        return harmonies, []
+    return [], slices
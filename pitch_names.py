@@ -0,0 +1,3 @@
+# Pitch name constants shared by the trainers (musicxml_tokens), the fitness engine and playback (streaming),
+# kept here so none of them has to import another just for these, and none of them loads music21.
+NATURAL_STEPS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11} # semitones above C of every natural letter
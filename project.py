@@ -1,23 +1,31 @@
+from __future__ import annotations
 import sys
-from music21 import *
 import os
 import generate_markov
-import copy
 import time
 import drums
 import random
 import pickle 
+import functools
+from concurrent.futures import ProcessPoolExecutor
 
-mood_mode_map = {
-    'happy': scale.LydianScale,
-    'sad': scale.DorianScale,
-    'angry': scale.PhrygianScale
-}
+from fitness_engine import batch_fitness
+import genome
+import evolution
+import midi_writer
 
+# The music21 instrument class of every mood, by name (see mood_instrument)
 instrument_map = {
-    'happy': instrument.AltoSaxophone(),
-    'sad': instrument.Piano(),
-    'angry': instrument.Trumpet()
+    'happy': 'AltoSaxophone',
+    'sad': 'Piano',
+    'angry': 'Trumpet'
+}
+
+# The General MIDI program of every mood's instrument, so MIDI files can be written without loading music21
+program_map = {
+    'happy': 65, # AltoSaxophone
+    'sad': 0,    # Piano
+    'angry': 56  # Trumpet
 }
 
 tempo_map = {
@@ -26,239 +34,181 @@ tempo_map = {
     'angry': 130
 }
 
-# Do: FIRST FITNESS FUNCTION: check how well notes match with chord
 """
-generalFitnessFunction
-Input: A measure of a melody, and a measure of a harmony chord
-Description: Compares how many notes in the melody were in the chord
-Output: The proportion of similar notes to the number of melody notes
+mood_instrument
+Input: the mood
+Description: Makes the instrument for the mood, loading music21 only when it is needed
+Output: A music21 instrument
 """
-def generalFitnessFunction(melody: stream.Measure, harmony: stream.Measure)->int:
-    fitness = 0
-    for note in melody.notes:
-        if note.pitch.name in list(map(lambda p: p.name, harmony.notes[0].pitches)):
-            fitness += 1
-    return fitness / len(melody.notes) * 10
+def mood_instrument(mood):
+    from music21 import instrument
+    return getattr(instrument, instrument_map[mood])()
 
 
 """
-fitness_function
-Input: A measure, the mood given, and the tonic
-Description: check how well measure's notes fit in with mode
-Output: The fitness score
+select_generation
+Input: a seed for this generation, the mood, the tonic, the number of measures to keep, the subdivision probability,
+the number of measures to compose, and an optional filepath to export the composition to
+Description: Composes a piece, calculates the fitness of each measure, and keeps the best ones as genomes.
+Only depends on its arguments, so generations can run in separate processes
+Output: A list with the top n measures (melody and chord) as MeasureGenomes
 """
-def fitness_function(measure, mood, tonic='C'):
-    if mood not in mood_mode_map:
-        raise ValueError(f"Unsupported mood: {mood}")
-    
-    mode_class = mood_mode_map[mood](tonic)
-    allowed_pitches = set(p.name for p in mode_class.getPitches())
-
-    elements = list(measure.flat.notesAndRests)
-
-    score = 0
-    for i, element in enumerate(elements):
-        if isinstance(element, note.Note):
-            if element.name in allowed_pitches:
-                score += 2
-        elif isinstance(element, chord.Chord):
-            for n in element.notes:
-                if n.name in allowed_pitches:
-                    score += 2
-
-        if isinstance(element, note.Note):
-            if i + 1 < len(elements):
-                next_elem = elements[i + 1]
-                if isinstance(next_elem, note.Note):
-                    note_interval = interval.Interval(element, next_elem)
-                    interval_name = note_interval.name
-
-                    if mood == 'happy':
-                        if interval_name == 'M3' or interval_name == 'M-3':
-                            score +=1
-                        if interval_name == 'P5' or interval_name == 'P-5':
-                            score +=1
-                    if mood == 'sad':
-                        if interval_name == 'm2' or interval_name == 'm-2':
-                            score +=1
-                        if interval_name == 'M6' or interval_name == 'M-6':
-                            score +=1
-                    if mood == 'angry':
-                        if interval_name == 'm3' or interval_name == 'm-3':
-                            score +=1
-                        if interval_name == 'm7' or interval_name == 'm-7':
-                            score +=1
-
-    return score
+def select_generation(seed, mood='happy', tonic='C', top_n=2, prob=0.5, size=8, filepath=None):
+    random.seed(seed)
+    score_stream = generate_markov.create_composition(size, prob, filepath)
+    parts = score_stream.parts
+
+    #os.remove(filepath)
+    # score_stream.show('midi')
+    #score_stream.show("text")
+
+    genomes = [genome.from_measures(parts[0].measure(i + 1), parts[1].measure(i + 1)) for i in range(size)]
+    fitness = batch_fitness(*genome.encode_population(genomes), mood, tonic).tolist()
+    #print(f"Measure fitness = {fitness}")
+
+    # Select top-N scoring measures
+    best_measures = sorted(zip(genomes, fitness), key=lambda x: x[1], reverse=True)[:top_n]
+    return [g for g, _ in best_measures]
 
 
 """
-inversion
-Input: a measure containing the melody, and a measure containing the harmony chord
-Description: Taking the root of the harmony, invert the melody based off of the distance from the root
-Output: A list of notes indicating the new melody
+compose_generations
+Input: a list with one seed per generation, the mood, the tonic, the number of measures to keep, the subdivision
+probability, the number of measures to compose, the number of worker processes, and an optional filepath
+Description: Runs select_generation for every seed, in a process pool when workers is more than 1.
+Every generation is exported to its own file, the seed added to the filepath, so no two generations write the same file
+Output: The selected genomes of every generation, in generation order
 """
-def inversion(melody: stream.Measure, harmony: stream.Measure):
-    c = harmony.notes[0]
-    base_pitch = c.root()
-    new_measure = stream.Measure()
-    for n in melody.notes:
-        p = n.pitch.ps
-        distance = p - base_pitch.ps 
-        new_note = note.Note(base_pitch.ps-distance)
-        new_note.quarterLength = n.quarterLength
-        new_note.pitch.ps += 12
-        new_measure.append(new_note)
-    return list(new_measure.notes)
-        
+def compose_generations(seeds, mood='happy', tonic='C', top_n=2, prob=0.5, size=8, workers=None, filepath=None):
+    select = functools.partial(select_generation, mood=mood, tonic=tonic, top_n=top_n, prob=prob, size=size)
+    paths = [generation_path(filepath, seed) for seed in seeds]
+    if not workers or workers <= 1:
+        return [select(seed, filepath=path) for seed, path in zip(seeds, paths)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map hands the results back in the order of the seeds, whichever worker finishes first
+        return list(executor.map(select_with_path, [select] * len(seeds), seeds, paths))
+
+
 """
-crossover
-Input: Two measures, and a float indicating where we will make the split
-Description: Split the measures in half, and then cross them over
-Output: list of notes indicating a new melody
+generation_path
+Input: the filepath to export to (or None) and the seed of a generation
+Description: Adds the seed before the extension, so "piece.xml" becomes "piece_1234.xml"
+Output: The filepath of that generation, or None
 """
-def crossover(measure1: stream.Measure, measure2: stream.Measure, split_beat=2.0):
-    def split_by_beat(m):
-        first_half = stream.Measure(number=m.number)
-        second_half = stream.Measure(number=m.number)
-        for el in m:
-            if isinstance(el, (note.Note, note.Rest, chord.Chord)):
-                if el.offset < split_beat:
-                    first_half.insert(el.offset, copy.deepcopy(el))
-                else:
-                    second_half.insert(el.offset - split_beat, copy.deepcopy(el))
-        return first_half, second_half
-    m1_first, m1_second = split_by_beat(measure1)
-    m2_first, m2_second = split_by_beat(measure2)
-    child1 = stream.Measure(number=measure1.number)
-    child2 = stream.Measure(number=measure2.number)
-    # Combine halves
-    for el in m1_first:
-        child1.insert(el.offset, el)
-    for el in m2_second:
-        child1.insert(el.offset + split_beat, el)
-    for el in m2_first:
-        child2.insert(el.offset, el)
-    for el in m1_second:
-        child2.insert(el.offset + split_beat, el)
+def generation_path(filepath, seed):
+    if not filepath:
+        return None
+    root, extension = os.path.splitext(filepath)
+    return f"{root}_{seed}{extension}"
 
-    
-    return list(child1.notes) + list(child2.notes)
 
+"""
+select_with_path
+Input: the select_generation partial, a seed and the filepath of that generation
+Description: Lets executor.map hand every generation its own filepath
+Output: The selected genomes of the generation
+"""
+def select_with_path(select, seed, filepath):
+    return select(seed, filepath=filepath)
 
 
 """
 final_piece
-Input: a filepath, the mode, the tonic, and the number of measures we want to return
+Input: an optional filepath to export each generated piece to, the mode, the tonic, the number of measures we want to return,
+the number of worker processes to compose generations with, and an optional master seed
 Description: Given a generated piece, calculate the fitness of each measure, and sort them in order.
+Every generation gets its own seed drawn from the master seed, so the piece is the same for any number of workers.
+The genetic operators work on MeasureGenomes, which are only turned back into music21 objects at the end
 Output: The top n measures
 """
-def final_piece(filepath='generated_piece.musicxml', mood='happy', tonic='C', top_n=2, prob=0.5, output_mode="midi"):
+def final_piece(filepath=None, mood='happy', tonic='C', top_n=2, prob=0.5, output_mode="midi", workers=None, seed=None):
     size = 8
 
     generations = 8
-    mutated_score = stream.Score()
-    mutated_melody = stream.Part()
-    final_harmony = stream.Part()
-    
-    instrument_for_mood = instrument_map[mood]  # Get the instrument from the map
-    tempo_for_mood = tempo_map[mood]  # Get the tempo from the map
-    
+    master = random.Random(seed)
+    generation_seeds = [master.randrange(2**32) for _ in range(generations)]
+    mutation_seeds = [master.randrange(2**32) for _ in range(generations)]
+    selected = compose_generations(generation_seeds, mood, tonic, top_n, prob, size, workers, filepath)
 
+    melody_genomes = []
+    chord_genomes = []
     for j in range(generations):
-        #if not os.path.exists(filepath):
-        generate_markov.create_composition(size, prob)
-        score_stream = converter.parse(filepath)
-        parts = score_stream.parts
-        
-        
-        #os.remove(filepath)
-        # score_stream.show('midi')
-        #score_stream.show("text")
-
-        fitness_measures = []
-        for i in range(size):
-            composite_measure = stream.Measure(number=i + 1)
-            m1 = parts[0].measure(i+1)
-            m2 = parts[1].measure(i+1)
-            for part in parts:
-                part_measures = part.getElementsByClass(stream.Measure)
-                if i < len(part_measures):
-                    composite_measure.append(part_measures[i].flat.notesAndRests.stream())
-
-
-            fitness = fitness_function(composite_measure, mood, tonic) + generalFitnessFunction(m1, m2)
-            #print(f"Measure {i+1}: Fitness = {fitness}")
-
-            # Store full part-specific measures to rebuild later
-            measure_bundle = [copy.deepcopy(part.measure(i + 1)) for part in parts]
-            fitness_measures.append((measure_bundle, fitness))
-
-        # Select top-N scoring bundles
-        best_measures = sorted(fitness_measures, key=lambda x: x[1], reverse=True)[:top_n]
-
-        
-
-        # Rebuild parts from top measures
-        new_score = stream.Score()
-        for p_idx in range(len(parts)):
-            new_part = stream.Part()
-            new_part.insert(0, parts[p_idx].getInstrument())
-            new_part.insert(0, tempo.MetronomeMark(number=80))
-            for m_idx, (measure_bundle, _) in enumerate(best_measures):
-                m = measure_bundle[p_idx]
-                m.number = m_idx + 1
-                new_part.append(m)
-            new_score.append(new_part)
-
-
-        
-        chords = []
-        skip_next = False
+        best = selected[j]
+        random.seed(mutation_seeds[j])
 
         # Perform mating & mutations
-        for i in range(1, len(new_score.parts[0].getElementsByClass('Measure'))+1):
-            print("i = ", i)
-            # if skip_next:
-            #     skip_next = False
-            #     continue
+        for i in range(len(best)):
+            print("i = ", i + 1)
             mutation = random.random()
-            m1 = copy.deepcopy(new_score.parts[0].measure(i))
-            m2 = new_score.parts[1].measure(i)
+            m1 = best[i]
             if mutation <= 0.25:
-                mutated_melody.append(inversion(m1, m2))
+                melody_genomes.append(genome.inversion(m1))
                 print("inversion")
             # perform multiple-point mutation
             elif mutation >= 0.25 and mutation <= 0.50:
                 print("mutationated")
-                mutated = mutate_measure(m1, mood, tonic, mutation_rate=0.5)
-                mutated_melody.append(mutated)
+                melody_genomes.append(genome.mutate_measure(m1, mood, tonic, mutation_rate=0.5))
             # perform crossover 
-            elif mutation <= 0.80 and i <= len(new_score.parts[0].getElementsByClass('Measure')) - 1:
-                mutated_melody.append(crossover(m1, new_score.parts[0].measure(i+1)))
+            elif mutation <= 0.80 and i < len(best) - 1:
+                melody_genomes.extend(genome.crossover(m1, best[i + 1]))
                 print ("crossover")
                 break
             else:
-                mutated_melody.append(list(m1.notes))
+                melody_genomes.append(m1.notes_only())
 
-        for i in range(1, len(new_score.parts[1].getElementsByClass('Measure'))+1):
-            m2 = new_score.parts[1].measure(i)
-            cMeasure = stream.Measure()
-            cMeasure.append(m2.notes[0])
-            chords.append(cMeasure)
+        chord_genomes.extend(best)
+        print("finished gen")
 
-        # ## ADDED    
-        # for i in range(len(mutated_melody)):
-        #     m2 = new_score.parts[1].measure(min(i + 1, len(new_score.parts[1].getElementsByClass('Measure'))))
-        #     cMeasure = stream.Measure()
-        #     cMeasure.append(copy.deepcopy(m2.notes[0]))
-        #     chords.append(cMeasure)
+    return render_piece(melody_genomes, chord_genomes, mood, size * 4, output_mode)
 
 
-        print("finished gen")
-        final_harmony.append(chords)
-        
-       # Set instrument and tempo for melody part
+"""
+evolved_piece
+Input: the mood, the tonic, the probability of subdividing a beat, the output mode, the population size, the most
+generations to evolve for, the number of measures in the piece, and an optional seed
+Description: Instead of recomposing a piece every generation, evolves one population of measures with elitism
+and early stopping (see evolution.py), then plays the fittest distinct measures
+Output: The finished score
+"""
+def evolved_piece(mood='happy', tonic='C', prob=0.5, output_mode="midi", population_size=64, generations=100, measures=16, seed=None):
+    if seed is not None:
+        random.seed(seed)
+    population = evolution.initial_population(population_size, prob)
+    ranked, fitness, history = evolution.evolve(population, mood, tonic, generations)
+    print(f"Evolved for {len(history) - 1} generations, best fitness {history[0]:.2f} -> {history[-1]:.2f}")
+    best = evolution.distinct(ranked, measures)
+    # every drum pattern fills half a measure
+    return render_piece(best, best, mood, measures * 2, output_mode)
+
+
+"""
+render_piece
+Input: the melody genomes and the chord genomes in playing order, the mood, the number of drum measures, and the output mode
+Description: Turns the genomes into music21 parts (the only place they become music21 objects), adds drums,
+saves the score to examplePickle and shows it. The "midifile" mode writes emotional_jazz.mid with midi_writer
+straight from the genomes and the drum sequence instead, without building a score or loading music21
+Output: The finished score, or None in "midifile" mode
+"""
+def render_piece(melody_genomes, chord_genomes, mood, num_total_measures, output_mode="midi"):
+    if output_mode == "midifile":
+        groove = drums.generate_groove(mood, num_measures=num_total_measures)
+        melody_track, chord_track = midi_writer.genome_tracks(melody_genomes, chord_genomes, program_map[mood])
+        midi_writer.write_midi_file('emotional_jazz.mid', [melody_track, chord_track, groove], tempo_map[mood])
+        return None
+
+    from music21 import stream, tempo, instrument, metadata
+    mutated_score = stream.Score()
+    mutated_melody = stream.Part()
+    final_harmony = stream.Part()
+    
+    instrument_for_mood = mood_instrument(mood)  # Get the instrument from the map
+    tempo_for_mood = tempo_map[mood]  # Get the tempo from the map
+
+    for g in melody_genomes:
+        mutated_melody.append(genome.to_notes(g))
+    final_harmony.append([genome.to_chord_measure(g) for g in chord_genomes])
+
+    # Set instrument and tempo for melody part
     mutated_melody.insert(0, instrument_for_mood)
     mutated_melody.insert(0, tempo.MetronomeMark(number=tempo_for_mood))
 
@@ -277,13 +227,12 @@ def final_piece(filepath='generated_piece.musicxml', mood='happy', tonic='C', to
     mutated_score.metadata.composer = "Eileen Chen, Ezra Jonath, Johanne Antoine"
 
      # DRUMS
-    num_total_measures = size * 4
     # drum_seq = drums.generate_sequence(mood, num_measures=num_total_measures)
     #num_measures=len(mutated_melody.getElementsByClass(stream.Measure))
 
-    #ADDED
-    drum_seq = drums.generate_sequence(mood, num_measures=num_total_measures)
-    drum_part = drums.sequence_to_stream(drum_seq)
+    # swung, with velocities per hit; a printed score gets the hits on the grid
+    groove = drums.generate_groove(mood, num_measures=num_total_measures, jitter=0.0 if output_mode == "score" else drums.SWING_JITTER)
+    drum_part = drums.groove_to_stream(groove)
 
     # drum_seq = drums.generate_sequence(mood, num_measures=len(mutated_melody))
     # drum_part = drums.sequence_to_stream(drum_seq, swing=True)
@@ -306,56 +255,12 @@ def final_piece(filepath='generated_piece.musicxml', mood='happy', tonic='C', to
         mutated_score.show('text')
 
     #mutated_score.show("text")
-
-
-"""
-mutate_measure
-Input: measure: music21.stream.Measure, mood: 'happy', 'sad', 'angry' (maps to Lydian, Dorian, Phrygian), tonic: tonic root note (default 'C'), mutation_rate: probability of mutation per note/chord tone (0.0 to 1.0)
-Description:  Randomly mutates a measure's notes/chords to conform to the scale for a given mood.
-Output: A mutated copy of the measure.
-"""
-def mutate_measure(measure, mood, tonic='C', mutation_rate=0.3):
-    
-    if mood not in mood_mode_map:
-        raise ValueError(f"Unsupported mood: {mood}")
-    
-    #allowed_pitches = [p.name for p in mode_class.getPitches(tonic + '3', tonic + '6')]
-    mode_class = mood_mode_map[mood](tonic)
-    # allowed_pitches = set(p.name for p in mode_class.getPitches())
-    allowed_pitches = [p for p in mode_class.getPitches()]
-
-    mutated = copy.deepcopy(measure)
-    print("Mutated")
-    mutated.show("text")
-    mutated_result = stream.Measure()
-
-    for element in mutated.notes:
-        if random.random() < mutation_rate:
-            new_pitch = random.choice(allowed_pitches)
-            element.pitch = new_pitch
-        mutated_result.append(element)
-
-        # elif isinstance(element, chord.Chord):
-        #     new_pitches = []
-        #     for _ in element.pitches:
-        #         if random.random() < mutation_rate:
-        #             new_note = random.choice(allowed_pitches)
-        #             new_pitches.append(new_note)
-        #         else:
-        #             new_pitches.append(_.name)  # retain existing note
-        #     element.clearPitches()
-        #     for p in new_pitches:
-        #         element.add(pitch.Pitch(p))
-
-    print("Result")
-    mutated_result.show("text")
-    print(list(mutated_result.notes))
-    return list(mutated_result.notes)
-
+    return mutated_score
 
 
 if __name__ == "__main__":
     if ("-p" in sys.argv) and os.path.exists("examplePickle"):
+        from music21 import stream
         preloaded_file = open('examplePickle', 'rb')
         preloaded_notes = pickle.load(preloaded_file)
         finalStream = stream.Stream()
@@ -364,6 +269,8 @@ if __name__ == "__main__":
     else:
         if ("-m" in sys.argv):
             output_mode = "midi"
+        elif ("-f" in sys.argv):
+            output_mode = "midifile"
         elif ("-s" in sys.argv):
             output_mode = "score"
         else:
@@ -385,4 +292,7 @@ if __name__ == "__main__":
     else:
         prob = 0.8
 
-    final_piece(mood=mood, prob=prob, output_mode=output_mode)
+    if ("-e" in sys.argv):
+        evolved_piece(mood=mood, prob=prob, output_mode=output_mode)
+    else:
+        final_piece(mood=mood, prob=prob, output_mode=output_mode)
@@ -0,0 +1,155 @@
+import sys
+import time
+import streaming
+import midi_writer
+from project import tempo_map, program_map
+
+MELODY_CHANNEL = 0
+CHORD_CHANNEL = 1
+VELOCITY = 75 # the velocity of every melody and chord note
+LATE_AFTER = 0.005 # seconds past its time before an event counts as late
+LOOKAHEAD = 0.05 # seconds of slack needed before the next measure is generated between two events
+SPIN = 0.002 # the last stretch before an event is busy-waited instead of slept, to keep jitter low
+
+
+"""
+measure_events
+Input: a StreamedMeasure, and the beat the measure starts on
+Description: Turns the melody, chord and drums of the measure into note on/off messages. The drums keep the
+swing, timing and velocities drums.generate_groove gave them
+Output: A list of (beat, message) pairs, sorted by beat with note offs before note ons on the same beat
+"""
+def measure_events(measure, start_beat):
+    events = []
+    beat = start_beat
+    for midi, duration in zip(measure.melody_midi, measure.durations):
+        if midi is not None:
+            events.append((beat, 0, midi_writer.note_on(MELODY_CHANNEL, midi, VELOCITY)))
+            events.append((beat + duration, -1, midi_writer.note_off(MELODY_CHANNEL, midi)))
+        beat += duration
+
+    for midi in measure.chord_midi:
+        events.append((start_beat, 0, midi_writer.note_on(CHORD_CHANNEL, midi, VELOCITY)))
+        events.append((start_beat + 4.0, -1, midi_writer.note_off(CHORD_CHANNEL, midi)))
+
+    groove = measure.drums
+    for onset, duration, midi, velocity in zip(groove.onsets.tolist(), groove.durations.tolist(),
+                                               groove.pitches.tolist(), groove.velocities.tolist()):
+        events.append((start_beat + onset, 0, midi_writer.note_on(midi_writer.DRUM_CHANNEL, midi, velocity)))
+        events.append((start_beat + onset + duration, -1, midi_writer.note_off(midi_writer.DRUM_CHANNEL, midi)))
+
+    events.sort(key=lambda e: (e[0], e[1]))
+    return [(beat, message) for beat, _, message in events]
+
+
+"""
+SchedulerStats
+What the scheduler measured: how many events it sent, how many were late, and the worst and mean lateness
+"""
+class SchedulerStats:
+    def __init__(self):
+        self.events = 0
+        self.late = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+    def record(self, lateness):
+        self.events += 1
+        self.total_lateness += max(lateness, 0.0)
+        self.max_lateness = max(self.max_lateness, lateness)
+        if lateness > LATE_AFTER:
+            self.late += 1
+
+    def report(self):
+        mean = self.total_lateness / self.events if self.events else 0.0
+        return (f"{self.events} events, {self.late} late (> {LATE_AFTER * 1000:.0f} ms), "
+                f"max lateness {self.max_lateness * 1000:.2f} ms, mean {mean * 1000:.3f} ms")
+
+
+"""
+play
+Input: the mood, a sink (midi_writer.MidiFileSink or MidiPortSink), how many measures to play (None plays forever),
+the probability of subdividing a beat, and whether to wait for each event's time
+Description: Pulls measures from streaming.stream_measures one at a time and sends their events to the sink at the
+mood's tempo. The next measure is generated in the first gap between events that leaves LOOKAHEAD to spare.
+Each event waits until its time (sleeping, then spinning for the last couple of milliseconds) and its lateness
+is recorded. The notes that are on are kept track of, and any still on when playing stops are let go
+Output: The SchedulerStats of the run
+"""
+def play(mood, sink, measures=None, prob=0.5, realtime=True):
+    bpm = tempo_map[mood]
+    seconds_per_beat = 60 / bpm
+    stats = SchedulerStats()
+    sink.send(0, midi_writer.program_change(MELODY_CHANNEL, program_map[mood]))
+
+    clock = [] # the time of beat 0, set by the first event so generating the first measure is not counted
+    sounding = {} # (channel, note) -> how many of its note ons have not had their note off yet
+    last_beat = 0.0
+    def dispatch(beat, message):
+        nonlocal last_beat
+        if realtime:
+            if not clock:
+                clock.append(time.perf_counter() - beat * seconds_per_beat)
+            due = clock[0] + beat * seconds_per_beat
+            wait = due - time.perf_counter()
+            if wait > SPIN:
+                time.sleep(wait - SPIN)
+            while time.perf_counter() < due:
+                pass
+            stats.record(time.perf_counter() - due)
+        else:
+            stats.events += 1
+        sink.send(beat, message)
+        last_beat = beat
+        key = (message[0] & 0x0F, message[1])
+        if message[0] & 0xF0 == 0x90:
+            sounding[key] = sounding.get(key, 0) + 1
+        elif message[0] & 0xF0 == 0x80 and sounding.get(key):
+            sounding[key] -= 1
+
+    pending = [] # note offs that fall after the current measure
+    measure_stream = streaming.stream_measures(mood, prob, measures)
+    try:
+        upcoming = next(measure_stream, None)
+        while upcoming is not None:
+            measure, upcoming = upcoming, None
+            next_bar = (measure.index + 1) * 4.0
+            # pending note offs go first, so they come before note ons on the same beat
+            events = sorted(pending + measure_events(measure, measure.index * 4.0), key=lambda e: e[0])
+            pending = [e for e in events if e[0] >= next_bar]
+            for beat, message in events:
+                if beat >= next_bar:
+                    continue
+                # make the next measure in the first gap between events that leaves time to spare
+                if upcoming is None and clock and clock[0] + beat * seconds_per_beat - time.perf_counter() > LOOKAHEAD:
+                    upcoming = next(measure_stream, None)
+                dispatch(beat, message)
+            if upcoming is None:
+                upcoming = next(measure_stream, None)
+        for beat, message in pending:
+            dispatch(beat, message)
+    finally:
+        # stopped early: silence whatever is still sounding, on the beat playing stopped at. Note offs still to
+        # come in the current measure are counted here too, not only the ones pending past it
+        for (channel, midi), count in sounding.items():
+            for _ in range(count):
+                sink.send(last_beat, midi_writer.note_off(channel, midi))
+        sink.close()
+    return stats
+
+
+if __name__ == "__main__":
+    # usage: python realtime.py <mood> <file.mid | --port> [measures]
+    mood = sys.argv[1] if len(sys.argv) > 1 else 'happy'
+    target = sys.argv[2] if len(sys.argv) > 2 else 'stream.mid'
+    measures = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    if target == '--port':
+        sink = midi_writer.MidiPortSink()
+    else:
+        sink = midi_writer.MidiFileSink(target, tempo_map[mood])
+    try:
+        stats = play(mood, sink, measures)
+    except KeyboardInterrupt:
+        pass
+    else:
+        print(stats.report())
@@ -0,0 +1,173 @@
+from __future__ import annotations
+import copy
+import random
+
+from fitness_engine import mood_mode_map, mood_scale
+
+# The original music21 versions of the fitness functions and the genetic operators. The program scores and
+# breeds MeasureGenomes with fitness_engine and genome instead; these are kept so benchmark.py can check the
+# new versions against them and time both
+
+
+# Do: FIRST FITNESS FUNCTION: check how well notes match with chord
+"""
+generalFitnessFunction
+Input: A measure of a melody, and a measure of a harmony chord
+Description: Compares how many notes in the melody were in the chord
+Output: The proportion of similar notes to the number of melody notes
+"""
+def generalFitnessFunction(melody: stream.Measure, harmony: stream.Measure)->int:
+    fitness = 0
+    for note in melody.notes:
+        if note.pitch.name in list(map(lambda p: p.name, harmony.notes[0].pitches)):
+            fitness += 1
+    return fitness / len(melody.notes) * 10
+
+
+"""
+fitness_function
+Input: A measure, the mood given, and the tonic
+Description: check how well measure's notes fit in with mode
+Output: The fitness score
+"""
+def fitness_function(measure, mood, tonic='C'):
+    from music21 import note, chord, interval
+    if mood not in mood_mode_map:
+        raise ValueError(f"Unsupported mood: {mood}")
+    
+    mode_class = mood_scale(mood, tonic)
+    allowed_pitches = set(p.name for p in mode_class.getPitches())
+
+    elements = list(measure.flat.notesAndRests)
+
+    score = 0
+    for i, element in enumerate(elements):
+        if isinstance(element, note.Note):
+            if element.name in allowed_pitches:
+                score += 2
+        elif isinstance(element, chord.Chord):
+            for n in element.notes:
+                if n.name in allowed_pitches:
+                    score += 2
+
+        if isinstance(element, note.Note):
+            if i + 1 < len(elements):
+                next_elem = elements[i + 1]
+                if isinstance(next_elem, note.Note):
+                    note_interval = interval.Interval(element, next_elem)
+                    interval_name = note_interval.name
+
+                    if mood == 'happy':
+                        if interval_name == 'M3' or interval_name == 'M-3':
+                            score +=1
+                        if interval_name == 'P5' or interval_name == 'P-5':
+                            score +=1
+                    if mood == 'sad':
+                        if interval_name == 'm2' or interval_name == 'm-2':
+                            score +=1
+                        if interval_name == 'M6' or interval_name == 'M-6':
+                            score +=1
+                    if mood == 'angry':
+                        if interval_name == 'm3' or interval_name == 'm-3':
+                            score +=1
+                        if interval_name == 'm7' or interval_name == 'm-7':
+                            score +=1
+
+    return score
+
+
+"""
+inversion
+Input: a measure containing the melody, and a measure containing the harmony chord
+Description: Taking the root of the harmony, invert the melody based off of the distance from the root
+Output: A list of notes indicating the new melody
+"""
+def inversion(melody: stream.Measure, harmony: stream.Measure):
+    from music21 import stream, note
+    c = harmony.notes[0]
+    base_pitch = c.root()
+    new_measure = stream.Measure()
+    for n in melody.notes:
+        p = n.pitch.ps
+        distance = p - base_pitch.ps 
+        new_note = note.Note(base_pitch.ps-distance)
+        new_note.quarterLength = n.quarterLength
+        new_note.pitch.ps += 12
+        new_measure.append(new_note)
+    return list(new_measure.notes)
+        
+"""
+crossover
+Input: Two measures, and a float indicating where we will make the split
+Description: Split the measures in half, and then cross them over
+Output: list of notes indicating a new melody
+"""
+def crossover(measure1: stream.Measure, measure2: stream.Measure, split_beat=2.0):
+    from music21 import stream, note, chord
+    def split_by_beat(m):
+        first_half = stream.Measure(number=m.number)
+        second_half = stream.Measure(number=m.number)
+        for el in m:
+            if isinstance(el, (note.Note, note.Rest, chord.Chord)):
+                if el.offset < split_beat:
+                    first_half.insert(el.offset, copy.deepcopy(el))
+                else:
+                    second_half.insert(el.offset - split_beat, copy.deepcopy(el))
+        return first_half, second_half
+    m1_first, m1_second = split_by_beat(measure1)
+    m2_first, m2_second = split_by_beat(measure2)
+    child1 = stream.Measure(number=measure1.number)
+    child2 = stream.Measure(number=measure2.number)
+    # Combine halves
+    for el in m1_first:
+        child1.insert(el.offset, el)
+    for el in m2_second:
+        child1.insert(el.offset + split_beat, el)
+    for el in m2_first:
+        child2.insert(el.offset, el)
+    for el in m1_second:
+        child2.insert(el.offset + split_beat, el)
+
+    
+    return list(child1.notes) + list(child2.notes)
+
+
+"""
+mutate_measure
+Input: measure: music21.stream.Measure, mood: 'happy', 'sad', 'angry' (maps to Lydian, Dorian, Phrygian), tonic: tonic root note (default 'C'), mutation_rate: probability of mutation per note/chord tone (0.0 to 1.0)
+Description:  Randomly mutates a measure's notes/chords to conform to the scale for a given mood.
+Output: A mutated copy of the measure.
+"""
+def mutate_measure(measure, mood, tonic='C', mutation_rate=0.3):
+    from music21 import stream
+    
+    if mood not in mood_mode_map:
+        raise ValueError(f"Unsupported mood: {mood}")
+    
+    #allowed_pitches = [p.name for p in mode_class.getPitches(tonic + '3', tonic + '6')]
+    mode_class = mood_scale(mood, tonic)
+    # allowed_pitches = set(p.name for p in mode_class.getPitches())
+    allowed_pitches = [p for p in mode_class.getPitches()]
+
+    mutated = copy.deepcopy(measure)
+    mutated_result = stream.Measure()
+
+    for element in mutated.notes:
+        if random.random() < mutation_rate:
+            new_pitch = random.choice(allowed_pitches)
+            element.pitch = new_pitch
+        mutated_result.append(element)
+
+        # elif isinstance(element, chord.Chord):
+        #     new_pitches = []
+        #     for _ in element.pitches:
+        #         if random.random() < mutation_rate:
+        #             new_note = random.choice(allowed_pitches)
+        #             new_pitches.append(new_note)
+        #         else:
+        #             new_pitches.append(_.name)  # retain existing note
+        #     element.clearPitches()
+        #     for p in new_pitches:
+        #         element.add(pitch.Pitch(p))
+
+    return list(mutated_result.notes)
@@ -0,0 +1,91 @@
+from functools import lru_cache
+import math
+import random
+import numpy as np
+import generate_markov
+import drums
+from pitch_names import NATURAL_STEPS
+
+DRUM_PATTERNS_PER_MEASURE = 2 # every groove pattern fills half a measure
+DEFAULT_OCTAVE = 4 # the octave music21 gives a pitch name without one
+ACCIDENTAL_STEPS = {'#': 1, '-': -1, '~': 0.5, '`': -0.5} # semitones of every accidental sign in a music21 pitch name
+
+
+"""
+StreamedMeasure
+One measure of an endless piece: the melody as pitch names, MIDI numbers and durations,
+the chord figure and its MIDI numbers, and the drum groove (from drums.generate_groove)
+"""
+class StreamedMeasure:
+    __slots__ = ('index', 'melody', 'melody_midi', 'durations', 'chord', 'chord_midi', 'drums')
+
+    def __init__(self, index, melody, melody_midi, durations, chord, chord_midi, drums):
+        self.index = index
+        self.melody = melody
+        self.melody_midi = melody_midi
+        self.durations = durations
+        self.chord = chord
+        self.chord_midi = chord_midi
+        self.drums = drums
+
+
+"""
+pitch_midi
+Input: a pitch name from the melody chain
+Description: Finds the MIDI number of the pitch in the default octave, like note.Note(name) does, from the letter,
+the accidentals and the octave (if the name has one). Works it out by hand so music21 is never loaded
+Output: The MIDI number, or None if the name is not a pitch
+"""
+@lru_cache(maxsize=256)
+def pitch_midi(name):
+    step = name[:1].upper()
+    accidentals = name[1:].rstrip('0123456789')
+    octave = name[1 + len(accidentals):]
+    if step not in NATURAL_STEPS or any(a not in ACCIDENTAL_STEPS for a in accidentals):
+        return None
+    ps = NATURAL_STEPS[step] + sum(ACCIDENTAL_STEPS[a] for a in accidentals) + 12 * (int(octave or DEFAULT_OCTAVE) + 1)
+    # music21 rounds quarter tones up
+    return math.floor(ps + 0.5)
+
+
+"""
+chord_midi
+Input: the compiled chord chain, and a token id from it
+Description: Looks up the MIDI numbers of the chord, resolved when the chain was compiled
+Output: A tuple of MIDI numbers
+"""
+def chord_midi(chain, token):
+    return tuple(chain.chord(token)[0].tolist())
+
+
+"""
+stream_measures
+Input: the mood, the probability of subdividing a beat, and optionally how many measures to make
+Description: Generates the piece one measure at a time, forever unless count is given. The melody and chord
+chains carry their last elements (as many as their order) from one measure to the next, so the piece continues seamlessly, and
+nothing but that state is kept between measures, so memory stays the same however long it runs
+Output: Yields a StreamedMeasure at a time
+"""
+def stream_measures(mood='happy', prob=0.5, count=None):
+    melody_chain = generate_markov.melody_chain
+    chord_chain = generate_markov.chord_chain
+    melody_state = generate_markov.start_state(melody_chain)
+    chord_state = generate_markov.start_state(chord_chain)
+    drum_rng = np.random.default_rng(random.getrandbits(32))
+
+    index = 0
+    while count is None or index < count:
+        durations = generate_markov.rhythm_durations(1, prob)
+        melody = []
+        for _ in durations:
+            token = generate_markov.next_token(melody_chain, melody_state)
+            melody_state = melody_state[1:] + (token,)
+            melody.append(melody_chain.token_names[token])
+
+        token = generate_markov.next_token(chord_chain, chord_state)
+        chord_state = chord_state[1:] + (token,)
+        figure = chord_chain.token_names[token]
+
+        yield StreamedMeasure(index, melody, [pitch_midi(name) for name in melody], durations,
+                              figure, chord_midi(chord_chain, token), drums.generate_groove(mood, DRUM_PATTERNS_PER_MEASURE, rng=drum_rng))
+        index += 1